@@ -0,0 +1,31 @@
+import os
+
+class DiskCache: # Directory of cache files named by key, written through a temp file and replaced, the least recently used files are pruned past max_disk_entries.
+    def __init__(self, extension: str, directory: str | None = None, max_disk_entries: int = 128):
+        self.extension = extension
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+
+    def _read(self, key, load): # Returns load(file), or None on a miss or an unreadable file.
+        if self.directory is None:
+            return None
+        try:
+            path = os.path.join(self.directory, key + self.extension)
+            with open(path, 'rb') as f:
+                value = load(f)
+            os.utime(path) # Keeps recently used entries from being pruned.
+        except Exception:
+            return None
+        return value
+
+    def _write(self, key, dump): # dump(file) writes the entry, raises OSError if it can't be stored.
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key + self.extension)
+        with open(path + '.tmp', 'wb') as f:
+            dump(f)
+        os.replace(path + '.tmp', path)
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(self.extension)]
+        for stale in sorted(files, key=os.path.getmtime)[:-self.max_disk_entries]:
+            os.remove(stale)
@@ -1,4 +1,131 @@
+import numpy as np
+
+def _etrle_scan(compressed_image, header): # Walks the run headers only, literal runs are copied as whole slices. Returns the palette index and alpha of every pixel and the number of bytes read.
+    ptr = bytes(compressed_image)
+    length = len(ptr)
+    indices = bytearray()
+    alpha = bytearray()
+    index = 0
+
+    for header_entry in header:
+        width = header_entry['width']
+        height = header_entry['height']
+
+        for row in range(height):
+            row_width = 0
+            while row_width < width and index < length:
+                run = ptr[index]
+                index += 1
+                run_len = run & 0x7F
+
+                if run & 0x80:
+                    indices.extend(bytes(run_len))
+                    alpha.extend(bytes(run_len))
+                else:
+                    fill = ptr[index:index + run_len]
+                    index += len(fill)
+                    indices.extend(fill)
+                    alpha.extend(b'\xff' * len(fill))
+                row_width += run_len
+
+    return indices, alpha, index
+
+def _palette_table(palette):
+    table = np.zeros((256, 4), dtype=np.uint8)
+    table[:len(palette), :3] = np.array(palette, dtype=np.uint8).reshape(-1, 3)
+    return table
+
 def etrle_decompress(compressed_image, palette, header):
+    indices, alpha, _ = _etrle_scan(compressed_image, header)
+    # Expand the whole index buffer through a 256x4 palette table in one gather.
+    image = _palette_table(palette)[np.frombuffer(indices, dtype=np.uint8)]
+    image[:, 3] = np.frombuffer(alpha, dtype=np.uint8)
+    return image.tobytes()
+
+def etrle_decompress_indexed(compressed_image, header): # One uint8 index plane and one opacity mask per sub-image. Transparent runs come out as index 0, literal 0s are index 0 too but opaque.
+    indices, alpha, _ = _etrle_scan(compressed_image, header)
+    indices = np.frombuffer(indices, dtype=np.uint8)
+    alpha = np.frombuffer(alpha, dtype=np.uint8)
+    planes = []
+    masks = []
+    offset = 0
+    for header_entry in header:
+        width = header_entry['width']
+        height = header_entry['height']
+        plane = np.zeros(width * height, dtype=np.uint8)
+        mask = np.zeros(width * height, dtype=bool)
+        chunk = indices[offset:offset + width * height]
+        plane[:len(chunk)] = chunk
+        mask[:len(chunk)] = alpha[offset:offset + len(chunk)] != 0
+        planes.append(plane.reshape(height, width))
+        masks.append(mask.reshape(height, width))
+        offset += width * height
+    return planes, masks
+
+def etrle_decompress_frame(compressed_image, header_entry): # Decodes a single sub-image from its own compressed slice, see the sub header offset and size. Returns the index plane and opacity mask.
+    width = header_entry['width']
+    height = header_entry['height']
+    indices, alpha, end = _etrle_scan(compressed_image, [header_entry])
+    if len(indices) != width * height:
+        raise ValueError(f"Frame decoded to {len(indices)} pixels, expected {width * height}")
+    if bytes(compressed_image[end:]) not in (b'', b'\x00'): # Only the terminator of the last row may be left, anything else means the slice isn't this frame.
+        raise ValueError(f"Frame slice has {len(compressed_image) - end} bytes left over")
+    return np.frombuffer(indices, dtype=np.uint8).reshape(height, width), np.frombuffer(alpha, dtype=np.uint8).reshape(height, width) != 0
+
+def palette_expand(indices, palette, out=None, opaque=None): # Index plane to RGBA bytes, only needed for display and export. With out the pixels are written into that uint8 array instead. Without an opacity mask index 0 is taken as transparent.
+    table = _palette_table(palette)
+    table[:, 3] = 255
+    indices = np.asarray(indices, dtype=np.uint8).reshape(-1)
+    pixels = out.reshape(-1, 4) if out is not None else np.empty((len(indices), 4), dtype=np.uint8)
+    np.take(table, indices, axis=0, out=pixels)
+    pixels[:, 3] = np.where(np.asarray(opaque, dtype=bool).reshape(-1) if opaque is not None else indices != 0, 255, 0)
+    return out if out is not None else pixels.tobytes()
+
+def _etrle_encode(indices, opaque, width): # Encodes a flat pixel stream as rows of width pixels, each run capped at 0x7F and every row terminated with 0x00.
+    indices = np.asarray(indices, dtype=np.uint8).reshape(-1)
+    opaque = np.asarray(opaque, dtype=bool).reshape(-1)
+    count = len(indices)
+    if count == 0 or width == 0:
+        return bytearray()
+
+    position = np.arange(count)
+    column = position % width
+    boundary = (column % 0x7F) == 0
+    boundary[1:] |= opaque[1:] != opaque[:-1]
+    starts = np.flatnonzero(boundary)
+    lengths = np.diff(np.append(starts, count))
+    ends = starts + lengths
+    literal = opaque[starts]
+    row_end = ((ends % width) == 0) | (ends == count)
+
+    run_bytes = 1 + np.where(literal, lengths, 0) + row_end
+    run_pos = np.cumsum(run_bytes) - run_bytes
+    compressed = np.zeros(int(run_bytes.sum()), dtype=np.uint8)
+    compressed[run_pos] = np.where(literal, lengths, lengths | 0x80)
+    destination = np.repeat(run_pos + 1 - starts, lengths) + position
+    compressed[destination[opaque]] = indices[opaque]
+    return bytearray(compressed.tobytes())
+
+def _etrle_encode_frames(indices, opaque, header): # Encodes every sub-image once, recording where each one lands as it's emitted.
+    compressed = bytearray()
+    frames = []
+    start = 0
+    for header_entry in header:
+        count = header_entry['width'] * header_entry['height']
+        data = _etrle_encode(indices[start:start + count], opaque[start:start + count], header_entry['width'])
+        frames.append((len(compressed), len(data)))
+        compressed.extend(data)
+        start += count
+    return compressed, frames
+
+def etrle_compress_indexed(planes, header, masks=None): # Encodes index planes straight away, no color lookup. Returns the compressed bytes and the (offset, size) of every sub-image. Without opacity masks index 0 is taken as transparent.
+    indices = np.concatenate([np.asarray(plane, dtype=np.uint8).reshape(-1) for plane in planes]) if planes else np.zeros(0, dtype=np.uint8)
+    if masks is None:
+        return _etrle_encode_frames(indices, indices != 0, header)
+    opaque = np.concatenate([np.asarray(mask, dtype=bool).reshape(-1) for mask in masks]) if masks else np.zeros(0, dtype=bool)
+    return _etrle_encode_frames(indices, opaque, header)
+
+def etrle_decompress_py(compressed_image, palette, header): # Reference implementation, kept for benchmarks and verifying the vectorized decoder.
     ptr = bytearray(compressed_image)
     alpha_mask = bytes(palette[0] + (0,))
     image = bytearray()
@@ -31,7 +158,27 @@ def etrle_decompress(compressed_image, palette, header):
 
     return bytes(image)
 
-def etrle_compress(image, palette, header):
+def _palette_lookup(palette): # 24-bit RGB key to palette index table. Duplicate colors resolve to the last index, colors not in the palette to 0.
+    keys = np.array(palette, dtype=np.uint32).reshape(-1, 3)
+    keys = (keys[:, 0] << 16) | (keys[:, 1] << 8) | keys[:, 2]
+    last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+    lookup = np.zeros(1 << 24, dtype=np.uint8)
+    lookup[keys[last]] = last
+    return lookup
+
+def palette_index(image, palette): # RGBA bytes to palette indices and the opacity of every pixel, plus whether every opaque pixel is exactly a palette color.
+    pixels = np.frombuffer(image, dtype=np.uint8).reshape(-1, 4)
+    keys = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+    indices = _palette_lookup(palette)[keys]
+    opaque = pixels[:, 3] != 0
+    exact = bool(np.all(_palette_table(palette)[indices[opaque], :3] == pixels[opaque, :3]))
+    return indices, opaque, exact
+
+def etrle_compress(image, palette, header): # Returns the compressed bytes and the (offset, size) of every sub-image within them.
+    indices, opaque, exact = palette_index(image, palette)
+    return _etrle_encode_frames(indices, opaque, header)
+
+def etrle_compress_py(image, palette, header): # Reference implementation, kept for benchmarks. Note it encodes the whole image again for every header entry.
     palette_lookup = {}
     for idx, (r, g, b) in enumerate(palette):
         palette_lookup[(r, g, b)] = idx
@@ -0,0 +1,168 @@
+import os
+import sys
+import struct
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ETRLE import etrle_compress, etrle_compress_py, etrle_decompress, etrle_decompress_py
+from STI import STI8, rgb565_to_rgb888, rgb888_to_rgb565, quantize_cache
+from SLF import SLF
+from PATCH import PATCH
+
+'''
+Micro-benchmarks for the hot paths of the portrait swapper, run with: python Extras/BENCH.py
+Everything works on synthetic data so no game files are needed.
+'''
+
+def synthetic_palette(seed=0):
+    rng = np.random.default_rng(seed)
+    palette = [tuple(int(c) for c in rng.integers(1, 256, 3)) for _ in range(256)]
+    palette[0] = (255, 0, 255)
+    return palette
+
+def synthetic_medium(seed=0, frames=10, width=90, height=72): # RGBA atlas of a 10 frame medium portrait, frame 0 opaque and the rest mostly transparent like the eye/mouth overlays.
+    rng = np.random.default_rng(seed)
+    palette = synthetic_palette(seed)
+    table = np.array(palette, dtype=np.uint8)
+    indices = rng.integers(1, 255, (frames * height, width)).repeat(3, axis=1)[:, :width] # Repeat columns to get some coherence.
+    atlas = np.empty((frames * height, width, 4), dtype=np.uint8)
+    atlas[..., :3] = table[indices]
+    atlas[..., 3] = 255
+    for row in range(height, frames * height):
+        start = rng.integers(0, width)
+        end = rng.integers(start, width + 1)
+        transparent = np.ones(width, dtype=bool)
+        transparent[start:end] = False
+        atlas[row, transparent, :3] = palette[0]
+        atlas[row, transparent, 3] = 0
+    header = [{'offset': 0, 'size': 0, 'x': 0, 'y': 0, 'width': width, 'height': height} for _ in range(frames)]
+    return atlas.tobytes(), palette, header
+
+def bench(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<28}{best * 1000:9.3f} ms")
+    return best
+
+def bench_etrle_decompress(number=20):
+    atlas, palette, header = synthetic_medium()
+    compressed = bytes(etrle_compress(atlas, palette, header)[0])
+    if etrle_decompress(compressed, palette, header) != etrle_decompress_py(compressed, palette, header):
+        raise AssertionError("Vectorized ETRLE decoder output differs from the reference decoder")
+    print("ETRLE decompress (90x72 x10 medium portrait)")
+    reference = bench("reference", lambda: etrle_decompress_py(compressed, palette, header), number)
+    vectorized = bench("vectorized", lambda: etrle_decompress(compressed, palette, header), number)
+    print(f"  speedup: {reference / vectorized:.1f}x\n")
+
+def bench_etrle_compress(number=5):
+    atlas, palette, header = synthetic_medium()
+    compressed, frames = etrle_compress(atlas, palette, header)
+    if compressed * len(header) != etrle_compress_py(atlas, palette, header): # The reference repeats the whole atlas once per frame.
+        raise AssertionError("Vectorized ETRLE encoder output differs from the reference encoder")
+    print("ETRLE compress (90x72 x10 medium portrait)")
+    reference = bench("reference", lambda: etrle_compress_py(atlas, palette, header), number)
+    vectorized = bench("vectorized", lambda: etrle_compress(atlas, palette, header), number)
+    print(f"  speedup: {reference / vectorized:.1f}x\n")
+
+def synthetic_medium_sti(): # Unsaved STI8 holding the synthetic medium portrait with noise added so it needs real quantization.
+    atlas, palette, header = synthetic_medium()
+    pixels = np.frombuffer(atlas, dtype=np.uint8).reshape(-1, 4).copy()
+    opaque = pixels[:, 3] != 0
+    noise = np.random.default_rng(1).integers(0, 4, (int(opaque.sum()), 3))
+    pixels[opaque, :3] = np.clip(pixels[opaque, :3].astype(int) + noise, 1, 255)
+    sti = STI8()
+    sti.palette = tuple(palette)
+    sti.sub_header = header
+    sti.num_images, sti.width, sti.height = len(header), header[0]['width'], header[0]['height'] * len(header)
+    size = header[0]['width'] * header[0]['height'] * 4
+    sti.images = [pixels[i * size // 4:(i + 1) * size // 4].tobytes() for i in range(len(header))]
+    return sti
+
+def bench_sti8_save(number=3):
+    saved = synthetic_medium_sti().save()
+    def edit_one_frame():
+        sti = STI8(saved)
+        sti.images[3] = sti.images[5]
+        return sti.save()
+    print("STI8 save (90x72 x10 medium portrait)")
+    max_entries, directory = quantize_cache.max_entries, quantize_cache.directory
+    quantize_cache.max_entries, quantize_cache.directory = 0, None # The synthetic portrait is the same every time, with the cache on only the first save would quantize.
+    quantize_cache.entries.clear()
+    try:
+        bench("full quantize + encode", lambda: synthetic_medium_sti().save(), number)
+    finally:
+        quantize_cache.max_entries, quantize_cache.directory = max_entries, directory
+    synthetic_medium_sti().save()
+    bench("quantize cache hit", lambda: synthetic_medium_sti().save(), number)
+    bench("single frame edit", edit_one_frame, number)
+    print()
+
+def rgb565_to_rgb888_py(source): # The old per-pixel STI16 loops, used as reference.
+    rgb888 = bytearray(len(source) * 3 // 2)
+    for i in range(0, len(source), 2):
+        rgb565 = source[i] | (source[i+1] << 8)
+        r, g, b = (rgb565 >> 11) & 0x1F, (rgb565 >> 5) & 0x3F, rgb565 & 0x1F
+        rgb888[i*3//2:i*3//2+3] = (r << 3, g << 2, b << 3)
+    return bytes(rgb888)
+
+def rgb888_to_rgb565_py(image):
+    return bytearray().join(struct.pack('<H', ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)) for i in range(0, len(image), 3) for r, g, b in [image[i:i+3]])
+
+def bench_rgb565(number=5):
+    rgb = np.random.default_rng(0).integers(0, 256, 640 * 480 * 3, dtype=np.uint8).tobytes() # Correctness is checked by tests/test_rgb565.py.
+    source = rgb888_to_rgb565(rgb)
+    print("STI16 RGB565 codec (640x480)")
+    reference = bench("decode reference", lambda: rgb565_to_rgb888_py(source), number)
+    vectorized = bench("decode vectorized", lambda: rgb565_to_rgb888(source), number)
+    print(f"  speedup: {reference / vectorized:.1f}x")
+    reference = bench("encode reference", lambda: rgb888_to_rgb565_py(rgb), number)
+    vectorized = bench("encode vectorized", lambda: rgb888_to_rgb565(rgb), number)
+    print(f"  speedup: {reference / vectorized:.1f}x\n")
+
+def synthetic_archive(count=6000): # SLF/PATCH shaped file with count directory records and no entry data.
+    header = bytearray(532)
+    header[512:520] = struct.pack("<II", count, count)
+    directory = b''.join(f"PORTRAITS\\MEDIUM\\M{i:05}.STI".encode('ascii').ljust(256, b'\x00') + struct.pack("<II", 532, 0) + bytes(16) for i in range(count))
+    return bytes(header) + directory
+
+def slf_parse_py(data): # The old per-record SLF._parse, used as reference.
+    num_files = int.from_bytes(data[512:516], 'little')
+    header_start = len(data) - (num_files * 280)
+    files = {}
+    for i in range(num_files):
+        offset = header_start + i * 280
+        name = bytes(data[offset:offset+256]).decode('ascii', errors='ignore').rstrip('\x00')
+        files[name] = (int.from_bytes(data[offset+256:offset+260], 'little'), int.from_bytes(data[offset+260:offset+264], 'little'))
+    return files
+
+def patch_footer_py(data): # The old per-record PATCH._parse_footer, used as reference.
+    num_files = int.from_bytes(data[512:516], 'little')
+    footer = []
+    for i in range(num_files):
+        start = len(data) - (num_files - i) * 280
+        entry = data[start:start + 280]
+        path_end = entry.find(b'\x00')
+        path = entry[:256 if path_end == -1 else path_end].decode('utf-8', errors='ignore')
+        footer.append({'path': path, 'offset': int.from_bytes(entry[256:260], 'little'), 'size': int.from_bytes(entry[260:264], 'little')})
+    return footer
+
+def bench_directory_parse(number=10):
+    data = synthetic_archive()
+    slf, patch = SLF(data), PATCH(data)
+    if slf.files != slf_parse_py(data) or patch.footer != patch_footer_py(data):
+        raise AssertionError("Structured dtype directory parse differs from the reference parser")
+    print("Directory parse (6000 records)")
+    reference = bench("SLF reference", lambda: slf_parse_py(data), number)
+    vectorized = bench("SLF structured dtype", slf._parse, number)
+    print(f"  speedup: {reference / vectorized:.1f}x")
+    reference = bench("PATCH reference", lambda: patch_footer_py(data), number)
+    vectorized = bench("PATCH structured dtype", lambda: patch._parse_footer(data), number)
+    print(f"  speedup: {reference / vectorized:.1f}x\n")
+
+
+if __name__ == "__main__":
+    bench_etrle_decompress()
+    bench_etrle_compress()
+    bench_rgb565()
+    bench_sti8_save()
+    bench_directory_parse()
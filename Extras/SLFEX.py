@@ -49,6 +49,10 @@ class SLFExtractor:
         tk.Button(f, text="Select SLF File", command=self.select_slf_file).pack(side=tk.LEFT)
         self.file_label = tk.Label(f, text="No file selected")
         self.file_label.pack(side=tk.LEFT, padx=(10,0))
+        self.search = tk.Entry(f, width=40)
+        self.search.pack(side=tk.RIGHT)
+        self.search.bind("<KeyRelease>", lambda e: self.filter_entries())
+        tk.Label(f, text="Search (prefix or glob):").pack(side=tk.RIGHT, padx=(0,5))
     
         t = tk.Frame(main_frame)
         t.pack(fill=tk.BOTH, expand=True)
@@ -231,14 +235,30 @@ class SLFExtractor:
     def load_slf_entries(self):
         try:
             self.slf = SLF(self.slf_file)
-            self.tree.delete(*self.tree.get_children())
-            for name, (addr, size) in self.slf.files.items():
-                file_type = name[-3:]
-                self.tree.insert("", tk.END, values=(name, file_type, f"0x{addr:08X}", size))
+            self.show_entries(self.slf.files)
             self.status.config(text=f"Loaded {len(self.slf.files)} files")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to read SLF file:\n{str(e)}")
             self.status.config(text="Error loading file")
+
+    def show_entries(self, names):
+        self.tree.delete(*self.tree.get_children())
+        for name in names:
+            addr, size = self.slf.files[name]
+            file_type = name[-3:]
+            self.tree.insert("", tk.END, values=(name, file_type, f"0x{addr:08X}", size))
+
+    def filter_entries(self): # Case and separator insensitive, e.g. portraits/large or *\\M*.STI
+        if self.slf is None:
+            return
+        query = self.search.get().strip()
+        if not query:
+            self.show_entries(self.slf.files)
+            self.status.config(text=f"Loaded {len(self.slf.files)} files")
+            return
+        names = self.slf.path_index.glob(query) if any(c in query for c in '*?[') else self.slf.path_index.prefix(query)
+        self.show_entries(names)
+        self.status.config(text=f"{len(names)} of {len(self.slf.files)} files match")
         
     def modify_file(self):
         selection = self.tree.selection()
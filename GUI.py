@@ -2,11 +2,16 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import os
 import sys
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image, ImageTk
-from STI import STI8, STI16
+from VFS import VFS
+from STI import STI8, STI16, Frames, quantize_cache, encode_sti, set_quantize_cache_directory, sti_info
 
 class GUI:
-    def __init__(self, default_portraits, modded_portraits):
+    def __init__(self, default_portraits, modded_portraits, vfs=None, portrait_flags=None):
         try:
             from tkinterdnd2 import DND_FILES, TkinterDnD
             self.root = TkinterDnD.Tk()
@@ -24,8 +29,27 @@ class GUI:
         self.modded_portraits = modded_portraits
         self.medium_image_index = 0
         self.patch_file = None
+        self.vfs = vfs # Merged view of DATA.SLF and every patch, see VFS.
+        self.portrait_flags = portrait_flags or {} # STI flags of the default portraits, saves reading their headers out of the archive.
         self.current_selection = None
         self.cached_keys = ["", "", ""]
+        self._base_image = None # (frame data, composited base image), see base_image.
+        self.preview_cache = OrderedDict() # (key, frame, canvas width, canvas height, version) -> PhotoImage, least recently used first.
+        self.preview_cache_size = 64
+        self.content_versions = {} # key -> number of times the portrait changed, see portrait_changed.
+        self.sti_cache = OrderedDict() # key -> (version, Future of the parsed STI), filled ahead of the selection by prefetch_neighbours.
+        self.sti_cache_size = 48
+        self.prefetch_radius = 4 # Listbox entries above and below the selection to parse in the background.
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
+        self.saver = ThreadPoolExecutor(max_workers=1)
+        self.save_future = None # Future of the save running in the background, see save.
+        self.save_requested = False # Set when saving again is asked for mid-save, one more save runs when the current one finishes.
+        self.save_progress = (0, 0) # (entries written, total), updated from the save thread.
+        self.queued_edits = {} # key -> data or None to restore the default, edits made while a save is writing the patch. Applied once it's done.
+        self.decoder = ThreadPoolExecutor() # Reads and validates imported files.
+        self.encoder = None # ProcessPoolExecutor quantizing and encoding imported portraits, started on the first import.
+        self.import_jobs = {} # key -> {'base', 'images', 'sizes', 'future'} of imports still encoding, see submit_imports.
+        self.save_after_import = False # Set by import_roster, the patch is saved once every job of the batch is stored.
         self.loaded_sti = [b"", b"", b""]
         self.last_extract_dir = os.getcwd()
         self.extraction_format = 'PNG'
@@ -146,8 +170,11 @@ class GUI:
         self.change_button = ttk.Button(button_frame, text="Change Portrait", command=self.change_portrait)
         self.change_button.grid(row=0, column=0, padx=(0, 5))  
         
+        self.import_button = ttk.Button(button_frame, text="Import Folder", command=self.import_roster)
+        self.import_button.grid(row=0, column=1, padx=5)
+        
         self.save_button = ttk.Button(button_frame, text="Save", command=self.save)
-        self.save_button.grid(row=0, column=1, padx=(5, 0))
+        self.save_button.grid(row=0, column=2, padx=(5, 0))
 
         
         self.extract_button = ttk.Button(main_frame, text="Extract", command=self.extract)
@@ -246,12 +273,15 @@ class GUI:
              
     def populate_portrait_listbox(self):
         portrait_names = set()
-        for key in self.modded_portraits.keys():
-            if key.startswith(("PORTRAITS\\LARGE\\", "PORTRAITS/LARGE/")):
-                portrait_names.add(key[17:-4])
-        for key in self.default_portraits.keys():
-            if key.startswith(("PORTRAITS\\LARGE\\", "PORTRAITS/LARGE/")):
-                portrait_names.add(key[17:-4])
+        if self.vfs is not None: # Prefix query against the path indexes of every layer.
+            portrait_names.update(key[17:-4] for key in self.vfs.prefix("PORTRAITS\\LARGE\\"))
+        else:
+            for key in self.modded_portraits.keys():
+                if key.startswith(("PORTRAITS\\LARGE\\", "PORTRAITS/LARGE/")):
+                    portrait_names.add(key[17:-4])
+            for key in self.default_portraits.keys():
+                if key.startswith(("PORTRAITS\\LARGE\\", "PORTRAITS/LARGE/")):
+                    portrait_names.add(key[17:-4])
 
         # Sort and populate listbox
         sorted_names = sorted(list(portrait_names))
@@ -284,68 +314,139 @@ class GUI:
     def load_portraits(self, name):
         try:
             if self.cached_keys[0] != f"PORTRAITS\\LARGE\\L{name}.STI":
-                special_names = {"DRAZIC", "GLUMPH", "MADRAS", "MYLES", "RFS-81", "RODAN", "SAXX", "SEXUS", "SPARKLE", "TANTRIS", "URQ", "VI"}
-                
-                self.cached_keys[0] = f"PORTRAITS\\LARGE\\L{name}.STI"
-                
-                self.cached_keys[1] = f"PORTRAITS\\MEDIUM\\A{name}.STI" if name in special_names else f"PORTRAITS\\MEDIUM\\M{name}.STI"
-                
-                self.cached_keys[2] = f"PORTRAITS\\SMALL\\S{name}.STI"
+                self.cached_keys = self.portrait_keys(name)
                 
                 for i, key in enumerate(self.cached_keys):
-                    data = self.modded_portraits.get(key) or self.default_portraits[key]
-                    flags = int.from_bytes(data[16:20], 'little')
-                    transparent, high, indexed, zlib, etrle = ((flags >> i) & 1 for i in (0, 2, 3, 4, 5))
+                    self.loaded_sti[i] = self.portrait_sti(key)
                     canvas = [self.large_canvas, self.medium_canvas, self.small_canvas][i]
-                    if high:
-                        self.loaded_sti[i] = STI16(data)
+                    if isinstance(self.loaded_sti[i], STI16):
                         image = self.loaded_sti[i].image
                         width, height = self.loaded_sti[i].width, self.loaded_sti[i].height
-                    elif indexed:
-                        self.loaded_sti[i] = STI8(data)
+                    else:
                         image = self.loaded_sti[i].images
                         width, height = self.loaded_sti[i].sub_header[0]['width'], self.loaded_sti[i].sub_header[0]['height']
                     
-                    self.display_image(image, canvas, width, height)
+                    self.display_image(image, canvas, width, height, key)
                 self.alpha_value['text'] = '#{:02x}{:02x}{:02x}'.format(*self.loaded_sti[1].palette[0])
                 self.alpha_value.config(fg=self.alpha_value['text'])
+                self.prefetch_neighbours()
             else:
                 # Cycle medium portraits (when slider is moved)
                 self.medium_image_count = self.loaded_sti[1].num_images
                 self.medium_slider.config(to=self.medium_image_count-1)
-                self.display_image(self.loaded_sti[1].images, self.medium_canvas, self.loaded_sti[1].sub_header[self.medium_image_index]['width'], self.loaded_sti[1].sub_header[self.medium_image_index]['height'])
+                self.display_image(self.loaded_sti[1].images, self.medium_canvas, self.loaded_sti[1].sub_header[self.medium_image_index]['width'], self.loaded_sti[1].sub_header[self.medium_image_index]['height'], self.cached_keys[1])
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load portraits: {str(e)}")
     
-    def display_image(self, image_data, canvas, width, height):
+    def portrait_keys(self, name):
+        special_names = {"DRAZIC", "GLUMPH", "MADRAS", "MYLES", "RFS-81", "RODAN", "SAXX", "SEXUS", "SPARKLE", "TANTRIS", "URQ", "VI"}
+        return [
+            f"PORTRAITS\\LARGE\\L{name}.STI",
+            f"PORTRAITS\\MEDIUM\\A{name}.STI" if name in special_names else f"PORTRAITS\\MEDIUM\\M{name}.STI",
+            f"PORTRAITS\\SMALL\\S{name}.STI"
+        ]
+
+    def portrait_source(self, key): # Effective data and STI flags of a portrait, only called on the Tk thread.
+        lower = self.patch_file.defaults if self.patch_file is not None else None
+        if key in self.queued_edits and self.queued_edits[key] is not None:
+            data, layer = self.queued_edits[key], "PATCH"
+        elif key in self.queued_edits and isinstance(lower, VFS) and key in lower: # Restored, falls back to whatever is under the patch being edited.
+            data, layer = lower[key], lower.layer(key)
+        elif key in self.queued_edits:
+            data, layer = self.default_portraits[key], "DATA.SLF"
+        elif self.vfs is not None:
+            data, layer = self.vfs[key], self.vfs.layer(key)
+        else:
+            data, layer = (self.modded_portraits[key], "PATCH") if self.modded_portraits.get(key) else (self.default_portraits[key], "DATA.SLF")
+        flags = self.portrait_flags.get(key) if layer == "DATA.SLF" else None
+        if flags is None:
+            flags = int.from_bytes(data[16:20], 'little')
+        return data, flags
+
+    @staticmethod
+    def parse_portrait(data, flags): # Parses and fully decodes an STI, safe to run on the prefetch thread as it touches nothing shared.
+        transparent, high, indexed, zlib, etrle = ((flags >> i) & 1 for i in (0, 2, 3, 4, 5))
+        if high:
+            return STI16(data)
+        elif indexed:
+            sti = STI8(data)
+            sti.images.joined()
+            return sti
+        raise ValueError("Unsupported STI format")
+
+    def portrait_sti(self, key): # Parsed STI from the prefetch cache, waits for it if it's being parsed and parses it right away on a miss.
+        version = self.content_versions.get(key, 0)
+        entry = self.sti_cache.get(key)
+        if entry is not None and entry[0] == version:
+            self.sti_cache.move_to_end(key)
+            try:
+                return entry[1].result()
+            except Exception:
+                pass
+        sti = self.parse_portrait(*self.portrait_source(key))
+        future = Future()
+        future.set_result(sti)
+        self._cache_sti(key, version, future)
+        return sti
+
+    def _cache_sti(self, key, version, future):
+        self.sti_cache[key] = (version, future)
+        self.sti_cache.move_to_end(key)
+        while len(self.sti_cache) > self.sti_cache_size:
+            self.sti_cache.popitem(last=False)[1][1].cancel() # Drops queued parses that haven't started yet.
+
+    def prefetch_neighbours(self): # Queues the portraits around the selection for parsing, closest first.
+        selection = self.portrait_listbox.curselection()
+        if not selection:
+            return
+        current, size = selection[0], self.portrait_listbox.size()
+        for distance in range(1, self.prefetch_radius + 1):
+            for index in (current + distance, current - distance):
+                if not 0 <= index < size:
+                    continue
+                for key in self.portrait_keys(self.portrait_listbox.get(index)):
+                    version = self.content_versions.get(key, 0)
+                    entry = self.sti_cache.get(key)
+                    if entry is not None and entry[0] == version:
+                        continue
+                    try:
+                        data, flags = self.portrait_source(key)
+                    except Exception:
+                        continue
+                    self._cache_sti(key, version, self.prefetcher.submit(self.parse_portrait, data, flags))
+
+    def display_image(self, image_data, canvas, width, height, key=None):
         try:
             canvas.delete("all")
             c_width, c_height = int(canvas['width']), int(canvas['height'])
+            index = min(self.medium_image_index, len(image_data) - 1) if isinstance(image_data, Frames) else 0
+            cache_key = (key, index, c_width, c_height, self.content_versions.get(key, 0)) if key is not None else None
+            photo = self.preview_cache.get(cache_key)
+            if photo is not None: # Resizing and scrubbing land here, nothing to rebuild.
+                self.preview_cache.move_to_end(cache_key)
+                canvas.create_image(0, 0, image=photo, anchor='nw')
+                canvas.image = photo
+                return
             
-            if isinstance(image_data, list):
-                img = Image.new('RGBA', (width, height))
-                index = min(self.medium_image_index, len(image_data) - 1)
-                
+            if isinstance(image_data, Frames):
                 if len(image_data[index]) == width * height * 4:
-                    img.putdata([(r, g, b, a) for r, g, b, a in zip(image_data[index][::4], image_data[index][1::4], image_data[index][2::4], image_data[index][3::4])])
+                    img = Image.frombuffer('RGBA', (width, height), image_data[index], 'raw', 'RGBA', 0, 1)
                 elif len(image_data[index]) == width * height * 3:
-                    img.putdata([(r, g, b, 255) for r, g, b in zip(image_data[index][::3], image_data[index][1::3], image_data[index][2::3])])
+                    img = Image.frombuffer('RGB', (width, height), image_data[index], 'raw', 'RGB', 0, 1).convert('RGBA')
                 else:
                     img = Image.new('RGBA', (width, height), (255, 0, 0, 255))
                 
                 if self.medium_image_index != 0:
-                    base_img = Image.new('RGBA', (width, height))
-                    if len(image_data[0]) == width * height * 4:
-                        base_img.putdata([(r, g, b, a) for r, g, b, a in zip(image_data[0][::4], image_data[0][1::4], image_data[0][2::4], image_data[0][3::4])])
-                    else:
-                        base_img = Image.new('RGBA', (width, height), (0, 0, 0, 255))
-                    img = Image.alpha_composite(base_img, img)
+                    img = Image.alpha_composite(self.base_image(image_data[0], width, height), img)
             else:
-                img = Image.new('RGB', (width, height))
-                img.putdata([(r, g, b) for r, g, b in zip(image_data[::3], image_data[1::3], image_data[2::3])])
+                img = Image.frombuffer('RGB', (width, height), image_data, 'raw', 'RGB', 0, 1)
             
             img = img.resize((c_width, c_height), Image.LANCZOS)
             photo = ImageTk.PhotoImage(img)
+            if cache_key is not None:
+                self.preview_cache[cache_key] = photo
+                while len(self.preview_cache) > self.preview_cache_size:
+                    self.preview_cache.popitem(last=False)
             canvas.create_image(0, 0, image=photo, anchor='nw')
             canvas.image = photo
         except Exception as e:
@@ -355,17 +456,46 @@ class GUI:
 
 
 
+    def set_portrait(self, key, data): # Stores a modded portrait, None restores the default. Held back in queued_edits while a save is running.
+        if self.save_future is not None:
+            self.queued_edits[key] = data
+        elif data is not None:
+            self.modded_portraits[key] = data
+        elif key in self.modded_portraits:
+            del self.modded_portraits[key]
+        self.portrait_changed(key)
+
+    def is_modded(self, key):
+        if key in self.queued_edits:
+            return self.queued_edits[key] is not None
+        return key in self.modded_portraits
+
+    def portrait_changed(self, key): # Call whenever a portrait's content changes, its cached previews and parsed STI are dropped.
+        self.content_versions[key] = self.content_versions.get(key, 0) + 1
+        self.sti_cache.pop(key, None)
+        for cache_key in [cache_key for cache_key in self.preview_cache if cache_key[0] == key]:
+            del self.preview_cache[cache_key]
+
+    def base_image(self, data, width, height): # The base frame every medium overlay is composited onto, rebuilt only when the frame data object changes.
+        if self._base_image is None or self._base_image[0] is not data or self._base_image[1].size != (width, height):
+            if len(data) == width * height * 4:
+                base_img = Image.frombuffer('RGBA', (width, height), data, 'raw', 'RGBA', 0, 1).copy()
+            else:
+                base_img = Image.new('RGBA', (width, height), (0, 0, 0, 255))
+            self._base_image = (data, base_img)
+        return self._base_image[1]
+
     def clear_canvas(self, canvas):
         canvas.delete("all")
         canvas.create_text(100, 100, text="No image")
 
     def update_canvas(self):
-        self.display_image(self.loaded_sti[0].image, self.large_canvas, self.loaded_sti[0].width, self.loaded_sti[0].height)
-        self.display_image(self.loaded_sti[1].images, self.medium_canvas, self.loaded_sti[1].sub_header[self.medium_image_index]['width'], self.loaded_sti[1].sub_header[self.medium_image_index]['height'])
+        self.display_image(self.loaded_sti[0].image, self.large_canvas, self.loaded_sti[0].width, self.loaded_sti[0].height, self.cached_keys[0])
+        self.display_image(self.loaded_sti[1].images, self.medium_canvas, self.loaded_sti[1].sub_header[self.medium_image_index]['width'], self.loaded_sti[1].sub_header[self.medium_image_index]['height'], self.cached_keys[1])
         if hasattr(self.loaded_sti[2], 'image'):
-            self.display_image(self.loaded_sti[2].image, self.small_canvas, self.loaded_sti[2].width, self.loaded_sti[2].height)
+            self.display_image(self.loaded_sti[2].image, self.small_canvas, self.loaded_sti[2].width, self.loaded_sti[2].height, self.cached_keys[2])
         else:
-            self.display_image(self.loaded_sti[2].images, self.small_canvas, self.loaded_sti[2].sub_header[0]['width'], self.loaded_sti[2].sub_header[0]['height'])
+            self.display_image(self.loaded_sti[2].images, self.small_canvas, self.loaded_sti[2].sub_header[0]['width'], self.loaded_sti[2].sub_header[0]['height'], self.cached_keys[2])
                     
     def refresh(self):
                 self.cached_keys[0] = ''
@@ -376,6 +506,204 @@ class GUI:
         y = (window.winfo_screenheight() // 2) - (window.winfo_height() // 2)
         window.geometry(f'+{x}+{y}')
          
+    def decode_import(self, file_path, small_high): # Reads and validates one file on the decode threads. Returns (slot, data, (width, height), parsed STI), data being the pixels of a PNG or the bytes of an STI, slot None and data the message if it can't be used.
+        filename, extension = os.path.splitext(os.path.basename(file_path))
+        try:
+            if extension.lower() == '.png':
+                img = Image.open(file_path)
+                width, height = img.size
+                if width != height * self.aspect_ratio:
+                    return None, f"Incompatible image resolution: {file_path}", None, None
+                if width == 180 and height == 144: # Large portraits
+                    slot, mode = 0, 'RGB'
+                elif width == 90 and height == 72: # Medium portraits
+                    slot, mode = 1, 'RGBA'
+                elif height == 36 and width == 45: # Small portraits
+                    slot, mode = 2, 'RGB' if small_high else 'RGBA'
+                else:
+                    return None, f"Incompatible image resolution: {file_path}", None, None
+                return slot, (img if img.mode == mode else img.convert(mode)).tobytes(), (width, height), None
+            elif extension.lower() == '.sti':
+                with open(file_path, 'rb') as file:
+                    file_bytes = file.read()
+                sti = self.parse_portrait(file_bytes, int.from_bytes(file_bytes[16:20], 'little'))
+                width, height = (sti.width, sti.height) if isinstance(sti, STI16) else (sti.sub_header[0]['width'], sti.sub_header[0]['height'])
+                if (width == 180 and height == 144) or filename.startswith('L'):
+                    return 0, file_bytes, (width, height), sti
+                elif (width == 90 and height == 72) or filename.startswith('M'):
+                    return 1, file_bytes, (width, height), sti
+                elif (height == 36 and width in [45, 46]) or filename.startswith('S'):
+                    return 2, file_bytes, (width, height), sti
+                return None, f"Incompatible image resolution: {file_path}", None, None
+            return None, f"File is not PNG or STI: {file_path}", None, None
+        except Exception as e:
+            return None, f"Failed to process file {file_path}: {str(e)}", None, None
+
+    def import_job(self, jobs, key): # Pending changes of a portrait, continuing an import of it that's still encoding.
+        if key not in jobs:
+            pending = self.import_jobs.get(key)
+            if pending is not None:
+                jobs[key] = {'base': pending['base'], 'images': dict(pending['images']), 'sizes': dict(pending['sizes'])}
+            else:
+                jobs[key] = {'base': bytes(self.portrait_source(key)[0]), 'images': {}, 'sizes': {}}
+        return jobs[key]
+
+    def submit_imports(self, jobs): # Encodes the jobs in worker processes, they're all stored at once by poll_imports when the last one is done. Returns the errors of jobs that couldn't be started.
+        idle = not self.import_jobs
+        errors = []
+        for key, job in jobs.items():
+            if not job['images']: # A dropped STI and nothing else, stored as it is.
+                self.cancel_import(key)
+                self.set_portrait(key, job['base'])
+                continue
+            try:
+                if self.encoder is None:
+                    # Spawned, forking a process with Tk and the prefetch, decode and save threads running can deadlock the child on a lock one of them held.
+                    self.encoder = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'), initializer=set_quantize_cache_directory, initargs=(quantize_cache.directory,))
+                future = self.encoder.submit(encode_sti, job['base'], job['images'], job['sizes'])
+            except Exception as e: # A worker died and the pool is broken for good, the next import starts a new one.
+                self.reset_encoder()
+                self.portrait_changed(key) # Drops the preview of the import.
+                errors.append(f"Failed to encode {key}: {str(e)}")
+                continue
+            previous = self.import_jobs.pop(key, None)
+            if previous is not None:
+                previous['future'].cancel() # Superseded, the new job includes its images.
+            job['future'] = future
+            self.import_jobs[key] = job
+        if not self.import_jobs:
+            self.save_after_import = False
+        elif idle:
+            self.root.after(50, self.poll_imports)
+        return errors
+
+    def cancel_import(self, key): # Drops an import of the portrait that's still encoding, poll_imports would store it over a later change otherwise.
+        job = self.import_jobs.pop(key, None)
+        if job is not None:
+            job['future'].cancel()
+            self.portrait_changed(key) # Its preview was shown.
+        if not self.import_jobs:
+            self.save_after_import = False
+
+    def reset_encoder(self):
+        if self.encoder is not None:
+            self.encoder.shutdown(wait=False, cancel_futures=True)
+            self.encoder = None
+
+    def poll_imports(self):
+        if not self.import_jobs:
+            return
+        if not all(job['future'].done() for job in self.import_jobs.values()):
+            self.root.after(50, self.poll_imports)
+            return
+        jobs, self.import_jobs = self.import_jobs, {}
+        errors = []
+        for key, job in jobs.items():
+            try:
+                self.set_portrait(key, job['future'].result())
+            except BrokenProcessPool as e:
+                self.reset_encoder()
+                errors.append(f"Failed to encode {key}: {str(e)}")
+            except Exception as e:
+                errors.append(f"Failed to encode {key}: {str(e)}")
+        if any(key in self.cached_keys for key in jobs):
+            self.refresh() # Shows the saved result, quantization may have changed the colors.
+        if self.save_after_import:
+            self.save_after_import = False
+            self.save()
+        if errors:
+            messagebox.showerror("Error", "\n".join(errors))
+
+    def import_roster(self, directory=None): # Imports every portrait in a folder laid out like the game's, PORTRAITS/LARGE/L*.png, MEDIUM/M*0..9.png and SMALL/S*.png, as one batch ending in a single patch write.
+        if not directory:
+            directory = filedialog.askdirectory(title="Select Portraits Folder")
+            if not directory: return
+        portraits_dir = next((os.path.join(directory, name) for name in os.listdir(directory) if name.upper() == "PORTRAITS" and os.path.isdir(os.path.join(directory, name))), directory)
+        known = self.vfs if self.vfs is not None else self.default_portraits
+        prefixes = {"LARGE": ("L",), "MEDIUM": ("M", "A"), "SMALL": ("S",)}
+        slots = {"LARGE": 0, "MEDIUM": 1, "SMALL": 2}
+        entries = [] # (file path, key, image index, folder, small portrait is STI16)
+        skipped = []
+        
+        for folder_name in sorted(os.listdir(portraits_dir)):
+            folder = folder_name.upper()
+            if folder not in prefixes or not os.path.isdir(os.path.join(portraits_dir, folder_name)):
+                continue
+            for filename in sorted(os.listdir(os.path.join(portraits_dir, folder_name))):
+                file_path = os.path.join(portraits_dir, folder_name, filename)
+                name, extension = os.path.splitext(filename)
+                name, index = name.upper(), 0
+                if extension.lower() != '.png':
+                    skipped.append(f"Not a PNG: {file_path}")
+                    continue
+                if not name.startswith(prefixes[folder]):
+                    skipped.append(f"{folder} portraits must start with {' or '.join(prefixes[folder])}: {file_path}")
+                    continue
+                if folder == "MEDIUM": # Frame number at the end, e.g. MHUMM40.png is frame 0 of MHUMM4.
+                    if not name[-1].isdigit():
+                        skipped.append(f"No frame number 0-9 at the end of the name: {file_path}")
+                        continue
+                    name, index = name[:-1], int(name[-1])
+                key = f"PORTRAITS\\{folder}\\{name}.STI"
+                if key not in known and key not in self.modded_portraits:
+                    skipped.append(f"No portrait {key} in the game: {file_path}")
+                    continue
+                small_high = folder == "SMALL" and bool((self.portrait_source(key)[1] >> 2) & 1)
+                entries.append((file_path, key, index, folder, small_high))
+        
+        decoded = self.decoder.map(lambda entry: self.decode_import(entry[0], entry[4]), entries)
+        jobs = {}
+        imported = 0
+        for (file_path, key, index, folder, small_high), (slot, data, size, sti) in zip(entries, decoded):
+            if slot is None:
+                skipped.append(data)
+                continue
+            if slot != slots[folder]:
+                skipped.append(f"Resolution {size[0]}x{size[1]} doesn't fit {folder} portraits: {file_path}")
+                continue
+            try:
+                job = self.import_job(jobs, key)
+                if index >= sti_info(job['base'])['num_images']:
+                    skipped.append(f"No frame {index} in {key}: {file_path}")
+                    continue
+                job['images'][index] = data
+                if folder == "SMALL" or key == "PORTRAITS\\MEDIUM\\MHUMM4.STI":
+                    job['sizes'][index] = size
+                imported += 1
+            except Exception as e:
+                skipped.append(f"Failed to process file {file_path}: {str(e)}")
+        
+        jobs = {key: job for key, job in jobs.items() if job['images']}
+        if jobs:
+            self.save_after_import = True
+            skipped += self.submit_imports(jobs)
+        print(f"Importing {imported} files into {len(jobs)} portraits from {portraits_dir}" + "".join(f"\n\tSkipped {line}" for line in skipped))
+        self.show_report("Import Folder", f"Importing {imported} files into {len(jobs)} portraits, the patch is saved once they're encoded." if jobs else "Nothing to import.", skipped)
+
+    def show_report(self, title, summary, lines): # Dialog with a scrollable list, for reports too long for a message box.
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.configure(bg=self.bg_color)
+        dialog.transient(self.root)
+        
+        summary_label = ttk.Label(dialog, text=summary if not lines else f"{summary}\nSkipped {len(lines)} files:", 
+                                background=self.bg_color, foreground=self.fg_color, font=('SegoeUI', self.font_size), wraplength=600)
+        summary_label.pack(pady=10, padx=10)
+        
+        if lines:
+            text_frame = tk.Frame(dialog, bg=self.bg_color)
+            text_frame.pack(fill=tk.BOTH, expand=True, padx=10)
+            text = tk.Text(text_frame, width=100, height=min(len(lines), 20), wrap=tk.NONE, bg=self.button_bg, fg=self.fg_color, relief=tk.FLAT, highlightthickness=0)
+            scrollbar = ttk.Scrollbar(text_frame, orient="vertical", command=text.yview, style="Dark.Vertical.TScrollbar")
+            text.config(yscrollcommand=scrollbar.set)
+            text.insert(tk.END, "\n".join(lines))
+            text.config(state=tk.DISABLED)
+            text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        ttk.Button(dialog, text="OK", command=dialog.destroy).pack(pady=10)
+        self.center_window(dialog)
+
     def change_portrait(self, files = None):        
         if not files:
             files = filedialog.askopenfilenames(
@@ -384,84 +712,54 @@ class GUI:
             if not files:return
         files = sorted(files)    
         index = 0
-        medium_modified = False
-        
-        # Process each file
-        for file_path in files:
-            filename, extension = os.path.splitext(os.path.basename(file_path))
-            if extension.lower() == '.png':
-                try:
-                    img = Image.open(file_path)
-                    width, height = img.size
-                    
-                    if width == height * self.aspect_ratio:
-                        # Handle large portraits (180x144)
-                        if width == 180 and height == 144:
-                            if img.mode != 'RGB':
-                                img = img.convert('RGB')
-                            raw_data = list(img.getdata())
-                            self.loaded_sti[0].image = bytes(pixel for rgb in raw_data for pixel in rgb)
-                            self.modded_portraits[self.cached_keys[0]] = self.loaded_sti[0].save()
-        
-                        # Handle medium portraits (90x72)
-                        elif width == 90 and height == 72:
-                            if len(files) < 2: index = self.medium_image_index
-                            if img.mode != 'RGBA':
-                                img = img.convert('RGBA')
-                            raw_data = list(img.getdata())
-                            self.loaded_sti[1].images[index] = [pixel for rgb in raw_data for pixel in rgb]
-                            if self.cached_keys[1] == "PORTRAITS\\MEDIUM\\MHUMM4.STI":
-                                    self.loaded_sti[1].sub_header[index].update({'x': 0, 'y': 0, 'width': width, 'height': height})
-                            medium_modified = True
-                            index += 1                        
-                            
-                        # Handle small portraits (45x36 or 46x36)
-                        elif height == 36 and width == 45:
-                            if self.loaded_sti[2].high:
-                                if img.mode != 'RGB':
-                                    img = img.convert('RGB')
-                                raw_data = list(img.getdata())
-                                self.loaded_sti[2].image = bytes(pixel for rgb in raw_data for pixel in rgb)   
-                                self.loaded_sti[2].width = width
-                                self.loaded_sti[2].height = height
-                            elif self.loaded_sti[2].indexed:
-                                if img.mode != 'RGBA':
-                                    img = img.convert('RGBA')
-                                raw_data = list(img.getdata())
-                                self.loaded_sti[2].images[0] = bytes(pixel for rgb in raw_data for pixel in rgb)  
-                                self.loaded_sti[1].sub_header[index].update({'x': 0, 'y': 0, 'width': width, 'height': height})
-                            self.modded_portraits[self.cached_keys[2]] = self.loaded_sti[2].save()
-                        else:
-                            messagebox.showerror("Error", f"Incompatible image resolution: {file_path}")
-                    else:
-                        messagebox.showerror("Error", f"Incompatible image resolution: {file_path}")
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to process file {file_path}: {str(e)}")
-            elif extension.lower() == '.sti':
-                try:
-                    with open(file_path, 'rb') as file:
-                        file_bytes = file.read()
-                    flags = int.from_bytes(file_bytes[16:20], 'little')
-                    transparent, high, indexed, zlib, etrle = ((flags >> i) & 1 for i in (0, 2, 3, 4, 5))      
-                    sti = STI16(file_path) if high else STI8(file_path) if indexed else None
-                    width, height = (sti.width, sti.height) if isinstance(sti, STI16) else (sti.sub_header[0]['width'], sti.sub_header[0]['height'])
-                    if (width == 180 and height == 144) or filename.startswith('L'):
-                        self.loaded_sti[0] = sti
-                    elif (width == 90 and height == 72) or filename.startswith('M'):
-                        self.loaded_sti[1] = sti                 
-                    elif (height == 36 and width in [45, 46]) or filename.startswith('S'):
-                        self.loaded_sti[2] = sti
-                    else:
-                        messagebox.showerror("Error", f"Incompatible image resolution: {file_path}")
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to process file {file_path}: {str(e)}") 
-            else:
-                messagebox.showerror("Error", f"File is not PNG or STI: {file_path}")                        
+        small_high = bool(getattr(self.loaded_sti[2], 'high', False))
+        decoded = self.decoder.map(lambda file_path: self.decode_import(file_path, small_high), files)
+        jobs = {}
+        errors = []
+        
+        # Decoded files are applied in order to the loaded portraits for the preview, encoding is left to the workers.
+        for file_path, (slot, data, size, sti) in zip(files, decoded):
+            if slot is None:
+                errors.append(data)
+                continue
+            key = self.cached_keys[slot]
+            try:
+                if sti is not None:
+                    self.loaded_sti[slot] = sti
+                    jobs[key] = {'base': data, 'images': {}, 'sizes': {}} # Later files in the batch edit the dropped STI.
+                elif slot == 0:
+                    self.loaded_sti[0].image = data
+                    self.import_job(jobs, key)['images'][0] = data
+                elif slot == 1:
+                    if len(files) < 2: index = self.medium_image_index
+                    self.loaded_sti[1].images[index] = data # Copied straight into the atlas buffer.
+                    job = self.import_job(jobs, key)
+                    job['images'][index] = data
+                    if key == "PORTRAITS\\MEDIUM\\MHUMM4.STI":
+                        self.loaded_sti[1].sub_header[index].update({'x': 0, 'y': 0, 'width': size[0], 'height': size[1]})
+                        job['sizes'][index] = size
+                    index += 1
+                else:
+                    if self.loaded_sti[2].high:
+                        self.loaded_sti[2].image = data
+                        self.loaded_sti[2].width, self.loaded_sti[2].height = size
+                    elif self.loaded_sti[2].indexed:
+                        self.loaded_sti[2].images[0] = data
+                        self.loaded_sti[2].sub_header[0].update({'x': 0, 'y': 0, 'width': size[0], 'height': size[1]})
+                    job = self.import_job(jobs, key)
+                    job['images'][0] = data
+                    job['sizes'][0] = size
+                self.portrait_changed(key)
+            except Exception as e:
+                errors.append(f"Failed to process file {file_path}: {str(e)}")
                 
         self.update_canvas()
-        
-        if medium_modified:
-            self.modded_portraits[self.cached_keys[1]] = self.loaded_sti[1].save()
+        failed = self.submit_imports(jobs)
+        if failed:
+            self.refresh() # Back to the stored portraits, the previews of the failed imports were dropped.
+            errors += failed
+        if errors:
+            messagebox.showerror("Error", "\n".join(errors))
 
             
       
@@ -504,9 +802,10 @@ class GUI:
         
         if result == 'yes':
             # Restore all portraits
-            for key in list(self.modded_portraits.keys()):
-                if key in self.default_portraits:
-                    del self.modded_portraits[key]
+            for key in set(self.modded_portraits.keys()) | set(self.queued_edits) | set(self.import_jobs):
+                self.cancel_import(key)
+                if key in self.default_portraits and self.is_modded(key):
+                    self.set_portrait(key, None)
             self.refresh()
         elif result == 'this_portrait':
             # Restore current portrait only
@@ -517,8 +816,9 @@ class GUI:
                 f"PORTRAITS\\SMALL\\S{self.current_selection}.STI"
             ]
             for key in keys:
-                if key in self.modded_portraits:
-                    del self.modded_portraits[key]
+                self.cancel_import(key)
+                if self.is_modded(key):
+                    self.set_portrait(key, None)
             self.refresh()
         
     def extract(self):
@@ -651,18 +951,44 @@ class GUI:
 
 
 
-    def save(self):
-        if self.patch_file:
-            try:
-                # Save the patch file
-                self.patch_file.content = self.modded_portraits
-                print("Saving:\n\t" + "\n\t".join([key.split("\\")[-1].replace(".STI","")[1:] for key in self.patch_file.content.keys() if key.startswith("PORTRAITS\\LARGE\\L")]))
-                result = self.patch_file.save()
-                messagebox.showinfo(result[0], result[1])
-                
-                # Refresh display
-                self.refresh()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to save patch: {str(e)}")
-        else:
+    def save(self): # Writes the patch on the save thread, the window stays usable meanwhile. Saving again mid-save just queues one more save.
+        if not self.patch_file:
             messagebox.showwarning("Warning", "No patch file to save!")
+            return
+        if self.save_future is not None:
+            self.save_requested = True
+            return
+        self.patch_file.content = self.modded_portraits
+        print("Saving:\n\t" + "\n\t".join([key.split("\\")[-1].replace(".STI","")[1:] for key in self.patch_file.content.keys() if key.startswith("PORTRAITS\\LARGE\\L")]))
+        self.save_progress = (0, len(self.patch_file.content))
+        self.save_future = self.saver.submit(self.patch_file.save, progress=self.on_save_progress)
+        self.root.after(50, self.poll_save)
+
+    def on_save_progress(self, done, total): # Runs on the save thread, Tk is only touched from poll_save.
+        self.save_progress = (done, total)
+
+    def poll_save(self):
+        if not self.save_future.done():
+            done, total = self.save_progress
+            self.root.title(f"Wizardry 8 Portrait Swapper - Saving {done}/{total}")
+            self.root.after(50, self.poll_save)
+            return
+        self.root.title("Wizardry 8 Portrait Swapper")
+        future, self.save_future = self.save_future, None
+        if future.exception() is None:
+            for key in self.patch_file.dropped: # Left out of the patch as identical to what's under it, only removed here on the Tk thread.
+                if key in self.modded_portraits:
+                    del self.modded_portraits[key]
+                    self.portrait_changed(key)
+        queued, self.queued_edits = self.queued_edits, {}
+        for key, data in queued.items():
+            self.set_portrait(key, data)
+        if self.save_requested:
+            self.save_requested = False
+            self.save()
+        self.refresh()
+        try:
+            result = future.result()
+            messagebox.showinfo(result[0], result[1])
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save patch: {str(e)}")
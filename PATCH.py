@@ -1,9 +1,100 @@
 import os
 import sys
+import mmap
 import struct
+import hashlib
+import threading
+import contextlib
+from collections.abc import MutableMapping
+from SLF import read_directory, PathIndex
+
+class LazyContent(MutableMapping): # Patch entries kept as (offset, size) into the mapped patch file, read only when accessed. Assigned entries are held in memory until saved.
+    def __init__(self, path=None, footer=()):
+        self.path = path
+        self.refs = {}
+        self.loaded = {}
+        self.end = 0 # Where the entry data stops and the footer starts.
+        self.path_index = PathIndex() # Kept up to date as entries are added and deleted.
+        self.lock = threading.RLock() # Held while the mapping is read or swapped, so reads from another thread never see it closed.
+        self._mmap = None
+        if path is not None:
+            self.open(path, footer)
+
+    def open(self, path, footer): # Maps a patch file, every entry in the footer becomes a reference into it.
+        with self.lock:
+            self.close()
+            self.path = path
+            self.refs = {entry['path']: (entry['offset'], entry['size']) for entry in footer}
+            self.loaded = {}
+            self.path_index = PathIndex(self.refs)
+            self.remap()
+            self.end = len(self._mmap) - len(footer) * 280
+
+    def remap(self):
+        with self.lock:
+            self.unmap()
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def unmap(self): # Drops the mapping but keeps the references, for while the file underneath is being replaced.
+        with self.lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+    def close(self): # Entries still referencing the file are read in first so nothing is lost.
+        with self.lock:
+            if self._mmap is not None:
+                for path in list(self.refs):
+                    self.loaded[path] = self[path]
+                self.refs = {}
+                self.unmap()
+
+    def dead_space(self): # Bytes of entry data in the file that are no longer referenced, replaced or deleted entries.
+        return self.end - 532 - sum(size for offset, size in self.refs.values()) if self.path is not None else 0
+
+    def view(self, path): # Zero-copy view of an entry for writing it out, release it when done.
+        with self.lock:
+            if path in self.refs:
+                offset, size = self.refs[path]
+                return memoryview(self._mmap)[offset:offset + size]
+            return memoryview(self.loaded[path])
+
+    def __getitem__(self, path):
+        with self.lock:
+            if path in self.loaded:
+                return self.loaded[path]
+            offset, size = self.refs[path]
+            return self._mmap[offset:offset + size] # Copies just this entry, no views into the map are kept alive.
+
+    def __setitem__(self, path, data):
+        with self.lock:
+            if path not in self:
+                self.path_index.add(path)
+            self.refs.pop(path, None)
+            self.loaded[path] = data
+
+    def __delitem__(self, path):
+        with self.lock:
+            if path in self.loaded:
+                del self.loaded[path]
+            else:
+                del self.refs[path]
+            self.path_index.remove(path)
+
+    def __contains__(self, path):
+        return path in self.loaded or path in self.refs
+
+    def __iter__(self): # Iterates a snapshot, the keys can be listed on one thread while another is saving.
+        with self.lock:
+            paths = list(self.refs) + [path for path in self.loaded if path not in self.refs]
+        return iter(paths)
+
+    def __len__(self):
+        return len(self.refs) + len(self.loaded)
 
 class PATCH():
-    def __init__(self, source: str | bytes | None = None):   
+    def __init__(self, source: str | bytes | None = None, lazy: bool = False):   
         # Header Init
         self.content = {}
         self.path = '' 			# This is not actually important.
@@ -12,53 +103,65 @@ class PATCH():
         self.unknown = 33619967 #0200ffff LE, No idea what this is
         self.unknown2 = 1 		# No idea what this is
         self.footer = {}
+        self.defaults = {}		# Entries of the base archive, patch entries identical to them are left out on save.
+        self._default_digests = {}
+        self.dropped = set()	# Entries left out of the last save as identical to their defaults.
         
         if source is not None:
-            data = source if isinstance(source, bytes) else open(source, 'rb').read()
+            if not isinstance(source, bytes):
+                self.restore_journal(source)
+            if lazy and not isinstance(source, bytes):
+                # Only the header and footer are read, entry data stays in the mapped file until it's used.
+                self.content = LazyContent()
+                with open(source, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = source if isinstance(source, bytes) else open(source, 'rb').read()
             self.path = data[:80].decode('ascii', errors='ignore').strip('\x00')
             self.num_files, self.num_files, self.unknown, self.unknown2 = struct.unpack_from("<IIII", data, 512)
             self._parse_footer(data)
-            for entry in self.footer:
-                self.content[entry['path']] = data[entry['offset']:entry['offset']+entry['size']]
+            if isinstance(self.content, LazyContent):
+                data.close()
+                self.content.open(source, self.footer)
+            else:
+                for entry in self.footer:
+                    self.content[entry['path']] = data[entry['offset']:entry['offset']+entry['size']]
 
     def _parse_footer(self, data):
-        entry_bytes = []
-        entry_size = 280
-        
-        for i in range(self.num_files):
-            start_idx = len(data) - (self.num_files - i) * entry_size
-            entry_bytes.append(data[start_idx:start_idx + entry_size])
-        parsed_entries = []
-        for entry in entry_bytes:
-            path_end = entry.find(b'\x00')
-            if path_end == -1:
-                path = entry[:256].decode('utf-8', errors='ignore')
-            else:
-                path = entry[:path_end].decode('utf-8', errors='ignore')
-            offset = int.from_bytes(entry[256:260], byteorder='little')
-            size = int.from_bytes(entry[260:264], byteorder='little')
-            
-            parsed_entries.append({
-                'path': path,
-                'offset': offset,
-                'size': size
-            })
-        
-        self.footer = parsed_entries
+        names, offsets, sizes = read_directory(data, self.num_files)
+        self.footer = [{'path': name.split(b'\x00', 1)[0].decode('utf-8', errors='ignore'), 'offset': offset, 'size': size}
+                       for name, offset, size in zip(names, offsets, sizes)]
 
-    def _update_footer(self):
-        self.footer = {}
-        current_offset = 532
-        for path, data in sorted(self.content.items()):
-            self.footer[path] = { 
-                'offset': current_offset,
-                'size': len(data)
-                }
-            current_offset += len(data)
+    @property
+    def path_index(self): # Plain dict content has to be indexed on every call.
+        return self.content.path_index if isinstance(self.content, LazyContent) else PathIndex(self.content)
+
+    def _footer_entry(self, path, entry):
+        path_bytes = path.encode('utf-8', errors='ignore')
+        return (path_bytes + b'\x00' * (256 - len(path_bytes)) +
+                struct.pack("<II", entry['offset'], entry['size']) +
+                b'\x00' * 16) # Zero padding
     
-    def save(self, output_file=None):
+    def _duplicates(self): # Entries identical to their defaults, e.g. a re-imported vanilla portrait. Overriding it with itself only makes the patch bigger. Only reads the content.
+        lazy = isinstance(self.content, LazyContent)
+        duplicates = set()
+        for path in [path for path in self.content.keys() if path in self.defaults]:
+            default = self.defaults[path]
+            with (self.content.view(path) if lazy else memoryview(self.content[path])) as data:
+                if data.nbytes != len(default): # Sizes differ for almost every real edit, no need to hash those.
+                    continue
+                if path not in self._default_digests:
+                    self._default_digests[path] = hashlib.blake2b(default).digest()
+                if hashlib.blake2b(data).digest() == self._default_digests[path]:
+                    duplicates.add(path)
+        return duplicates
+
+    def save(self, output_file=None, compact=False, progress=None): # progress(done, total) is called after every entry written, from whatever thread is saving.
+        # Entries identical to the defaults are left out of the file. Lazy content drops them when it's reopened, a plain dict keeps them until the caller deletes self.dropped, so saving on another thread never changes a dict the caller may be iterating.
+        self.dropped = self._duplicates() if self.defaults else set()
+        paths = sorted(path for path in self.content.keys() if path not in self.dropped)
                
-        self.num_files = len(self.content)
+        self.num_files = len(paths)
         
         header = bytearray()
         
@@ -77,28 +180,13 @@ class PATCH():
         header.extend(b'\x00\x00\x00\x00')
         if len(header) != 532: raise ValueError("Header must be 532 bytes.")
 
-        content_bytes = bytearray()
-        for path, data in sorted(self.content.items()):
-            content_bytes.extend(data)
-
-        self._update_footer()
-        footer_bytes = bytearray()
-        for path in self.footer:
-            entry = self.footer[path]
-            path_bytes = path.encode('utf-8', errors='ignore')
-            path_len = len(path_bytes)
-            footer_bytes.extend(path_bytes)
-            footer_bytes.extend(b'\x00' * (256 - path_len))
-            footer_bytes.extend(struct.pack("<I", entry['offset']))
-            footer_bytes.extend(struct.pack("<I", entry['size']))
-            footer_bytes.extend(b'\x00' * 16) # Zero padding
-
-        all_bytes = header + content_bytes + footer_bytes
-
         if output_file is None:
             output_file = self.path
          
-        if len(self.content.keys()) == 0:
+        lazy = isinstance(self.content, LazyContent)
+        if len(paths) == 0:
+            if lazy:
+                self.content.close() # Windows won't delete a mapped file.
             try:
                 if os.path.exists(output_file):
                     os.remove(output_file)
@@ -106,11 +194,121 @@ class PATCH():
                 return ("Information", "Nothing to save.")
             except Exception as e:
                 return ("Error!", f"Failed to delete empty file: {str(e)}")
-                    
-        with open(output_file, 'wb') as f:
-            f.write(all_bytes)
+
+        # Lazy patches saved over their own file only append the changed entries and a new footer, unless asked to compact or over half the file would be dead space.
+        if (lazy and not compact and self.content.path is not None and os.path.exists(output_file)
+                and os.path.samefile(self.content.path, output_file)
+                and self.content.dead_space() <= sum(size for offset, size in self.content.refs.values())):
+            return self._append(output_file, header, progress)
+
+        # Stream everything into a temporary file next to the patch and swap it in at the end, a crash mid-write never leaves a truncated patch behind.
+        temp_file = output_file + '.tmp'
+        footer = {}
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(header)
+                current_offset = len(header)
+                for done, path in enumerate(paths, 1):
+                    # Untouched lazy entries are copied straight out of the old mapped file.
+                    with (self.content.view(path) if lazy else memoryview(self.content[path])) as data:
+                        f.write(data)
+                        footer[path] = {'offset': current_offset, 'size': len(data)}
+                        current_offset += len(data)
+                    if progress is not None:
+                        progress(done, len(paths))
+                f.writelines(self._footer_entry(path, entry) for path, entry in footer.items())
+                f.flush()
+                os.fsync(f.fileno())
+            with (self.content.lock if lazy else contextlib.nullcontext()):
+                if lazy:
+                    self.content.unmap() # Windows won't replace a mapped file.
+                try:
+                    os.replace(temp_file, output_file)
+                except BaseException:
+                    if lazy:
+                        self.content.remap()
+                    raise
+                if lazy:
+                    self.content.open(output_file, [dict(entry, path=path) for path, entry in footer.items()]) # Saved entries are dropped from memory and read back from the new file.
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        self.footer = footer
         return ("Success!", "Patch saved successfully!")
 
+    def compact(self, output_file=None): # Full rewrite that drops the dead space left behind by appending saves.
+        return self.save(output_file, compact=True)
+
+    @staticmethod
+    def restore_journal(path): # Undoes an append that was interrupted, see _append. Returns True if the patch was restored.
+        journal = path + '.journal'
+        if not os.path.exists(journal):
+            return False
+        with open(journal, 'rb') as f:
+            data = f.read()
+        restored = False
+        if len(data) >= 16:
+            length, end = struct.unpack_from('<QQ', data)
+            if len(data) == 16 + 532 + length - end: # A journal cut short was never finished, the patch wasn't touched yet.
+                with open(path, 'r+b') as f:
+                    f.write(data[16:548])
+                    f.seek(end)
+                    f.write(data[548:])
+                    f.truncate()
+                    f.flush()
+                    os.fsync(f.fileno())
+                restored = True
+        os.remove(journal)
+        return restored
+
+    def _append(self, output_file, header, progress=None):
+        # Written over the old footer in place. The old header, footer and length are journaled first so an interrupted append can be undone, see restore_journal.
+        # Entries are only written past the old entry data, so readers on other threads keep using the mapping until it's swapped at the very end.
+        content = self.content
+        journal = output_file + '.journal'
+        footer = {path: {'offset': offset, 'size': size} for path, (offset, size) in content.refs.items() if path not in self.dropped}
+        paths = sorted(path for path in content.loaded if path not in self.dropped)
+        with open(journal, 'wb') as f:
+            f.write(struct.pack('<QQ', len(content._mmap), content.end))
+            f.write(content._mmap[:532])
+            f.write(content._mmap[content.end:])
+            f.flush()
+            os.fsync(f.fileno())
+        swapped = False
+        try:
+            with open(output_file, 'r+b') as f:
+                f.seek(content.end)
+                current_offset = content.end
+                for done, path in enumerate(paths, 1):
+                    with memoryview(content.loaded[path]) as data:
+                        f.write(data)
+                        footer[path] = {'offset': current_offset, 'size': len(data)}
+                        current_offset += len(data)
+                    if progress is not None:
+                        progress(done, len(paths))
+                footer = dict(sorted(footer.items()))
+                f.writelines(self._footer_entry(path, entry) for path, entry in footer.items())
+                f.seek(0)
+                f.write(header)
+                f.flush()
+                os.fsync(f.fileno())
+                with content.lock: # Readers only wait for the mapping to be swapped.
+                    content.unmap() # Windows won't truncate a mapped file.
+                    f.truncate(current_offset + len(footer) * 280)
+                    content.open(output_file, [dict(entry, path=path) for path, entry in footer.items()])
+                    swapped = True
+                os.fsync(f.fileno())
+            os.remove(journal)
+        except BaseException:
+            if not swapped: # Once swapped the content matches the new file, the journal is kept so the next open rolls back an unsynced truncate.
+                try:
+                    self.restore_journal(output_file)
+                finally:
+                    content.remap()
+            raise
+        self.footer = footer
+        return ("Success!", "Patch saved successfully!")
 
     def __str__(self):
         footer_str = "\n".join([f"\tPath: {entry['path']}, Offset: {entry['offset']}, Size: {entry['size']}" for entry in self.footer])
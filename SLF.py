@@ -1,33 +1,135 @@
-class SLF:
-    def __init__(self, source: str | bytes | None = None):   
+import os
+import mmap
+import json
+import hashlib
+import bisect
+import fnmatch
+import numpy as np
+from collections.abc import Mapping
+from CACHE import DiskCache
+
+DIRECTORY_RECORD = np.dtype([('name', 'S256'), ('offset', '<u4'), ('size', '<u4'), ('padding', 'V16')]) # 280-byte directory record at the end of SLF and PATCH files.
+
+def read_directory(data, count): # Parses every directory record in one pass, returns the raw names, offsets and sizes as lists.
+    records = np.frombuffer(data, dtype=DIRECTORY_RECORD, count=count, offset=len(data) - count * DIRECTORY_RECORD.itemsize)
+    return records['name'].tolist(), records['offset'].tolist(), records['size'].tolist()
+
+def normalize_path(path): # Archive paths are case insensitive and use either separator.
+    return path.replace('/', '\\').upper()
+
+class PathIndex: # Normalized paths kept sorted, prefix and glob queries bisect to the matching range instead of scanning every entry.
+    def __init__(self, paths=()):
+        self.paths = {normalize_path(path): path for path in paths} # Normalized -> original path.
+        self.keys = sorted(self.paths)
+
+    def add(self, path):
+        key = normalize_path(path)
+        if key not in self.paths:
+            bisect.insort(self.keys, key)
+        self.paths[key] = path
+
+    def remove(self, path):
+        key = normalize_path(path)
+        if self.paths.pop(key, None) is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def _range(self, prefix):
+        return self.keys[bisect.bisect_left(self.keys, prefix):bisect.bisect_left(self.keys, prefix + '\U0010ffff')]
+
+    def prefix(self, prefix): # Original paths starting with prefix, sorted.
+        return [self.paths[key] for key in self._range(normalize_path(prefix))]
+
+    def glob(self, pattern): # Only the range matching the literal part before the first wildcard is checked.
+        pattern = normalize_path(pattern)
+        literal = len(pattern)
+        for wildcard in '*?[':
+            if wildcard in pattern:
+                literal = min(literal, pattern.index(wildcard))
+        return [self.paths[key] for key in self._range(pattern[:literal]) if fnmatch.fnmatchcase(key, pattern)]
+
+class IndexCache(DiskCache): # JSON documents about archives on disk, keyed by path, size and mtime so a changed archive is simply a miss. SLF keeps its parsed directory here.
+    def __init__(self, directory: str | None = None, max_disk_entries: int = 16):
+        super().__init__(".json", directory, max_disk_entries)
+
+    def _key(self, source, kind):
+        stat = os.stat(source)
+        return hashlib.blake2b(f"{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}|{kind}".encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, source, kind: str = "files"): # Returns the stored document, or None.
+        if self.directory is None:
+            return None
+        try:
+            key = self._key(source, kind)
+        except OSError:
+            return None
+        return self._read(key, json.load)
+
+    def put(self, source, value, kind: str = "files"):
+        if self.directory is None:
+            return
+        try:
+            self._write(self._key(source, kind), lambda f: f.write(json.dumps(value).encode('utf-8')))
+        except OSError as e:
+            print(f"Warning: Failed to write SLF index cache: {e}")
+
+index_cache = IndexCache()
+
+class SLF(Mapping): # Read-only name -> entry data mapping, entries are views in mmap mode.
+    def __init__(self, source: str | bytes | None = None, use_mmap: bool = False):   
         self.data = bytes()
         self.num_files = 0
         self.files = {}
+        self._mmap = None
+        self._path_index = None
 
         if source is not None:
-            self.data = source if isinstance(source, bytes) else open(source, 'rb').read()
-            self._parse()    
+            if use_mmap and not isinstance(source, bytes):
+                # Map the archive instead of reading it, pages are only loaded once an entry is actually touched.
+                with open(source, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = memoryview(self._mmap)
+            else:
+                self.data = source if isinstance(source, bytes) else open(source, 'rb').read()
+            cached = index_cache.get(source) if not isinstance(source, bytes) else None
+            if cached is not None:
+                self.files = {name: tuple(entry) for name, entry in cached.items()}
+                self.num_files = len(self.files)
+            else:
+                self._parse()
+                if not isinstance(source, bytes):
+                    index_cache.put(source, self.files)
             
     def _parse(self):
         self.num_files = int.from_bytes(self.data[512:516], 'little')
-        header_start = len(self.data) - (self.num_files * 280)
-        files = {}
-        
-        for i in range(self.num_files):
-            offset = header_start + i * 280
-            name = self.data[offset:offset+256].decode('ascii', errors='ignore').rstrip('\x00')
-            addr = int.from_bytes(self.data[offset+256:offset+260], 'little')
-            size = int.from_bytes(self.data[offset+260:offset+264], 'little')
-            files[name] = (addr, size)
-        
-        self.files = files
+        names, offsets, sizes = read_directory(self.data, self.num_files)
+        self.files = {name.decode('ascii', errors='ignore').rstrip('\x00'): entry for name, entry in zip(names, zip(offsets, sizes))}
+        self._path_index = None
             
-    def extract(self, filename: str, output_path: str | None = None) -> bytes | None:
+    @property
+    def path_index(self): # Built on first use.
+        if self._path_index is None:
+            self._path_index = PathIndex(self.files)
+        return self._path_index
+
+    def __getitem__(self, filename):
+        addr, size = self.files[filename]
+        return self.data[addr:addr + size]
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def extract(self, filename: str, output_path: str | None = None) -> bytes | memoryview | None:
         if filename not in self.files:
             raise IndexError(f"File {filename} not found")
         
         addr, size = self.files[filename]
-        file_data = self.data[addr:addr + size]
+        file_data = self.data[addr:addr + size] # Zero-copy view in mmap mode.
         
         if output_path is not None:
             with open(output_path, 'wb') as f:
@@ -36,5 +138,9 @@ class SLF:
         else:
             return file_data
 
-
-
+    def close(self): # Only possible once every view handed out by extract() has been dropped.
+        if self._mmap is not None:
+            self.data.release()
+            self._mmap.close()
+            self._mmap = None
+            self.data = bytes()
@@ -1,12 +1,155 @@
 import struct
 from PIL import Image
 import os
+import hashlib
 import numpy as np
-from collections import Counter
-from ETRLE import etrle_compress, etrle_decompress
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+from CACHE import DiskCache
+from ETRLE import etrle_compress, etrle_decompress_indexed, etrle_decompress_frame, etrle_compress_indexed, palette_expand, palette_index
+
+class QuantizeCache(DiskCache): # Bounded LRU of quantization results keyed by a hash of the RGBA atlas and the palette colors it depends on, optionally mirrored to disk.
+    def __init__(self, max_entries: int = 64, directory: str | None = None, max_disk_entries: int = 128):
+        super().__init__(".npz", directory, max_disk_entries)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def _keys(self, atlas, palette): # Imagequant results only depend on the alpha and end colors, the already quantized branch depends on the whole palette.
+        digest = hashlib.blake2b(atlas, digest_size=16)
+        digest.update(bytes(palette[0]) + bytes(palette[255]))
+        base = digest.hexdigest()
+        return base, base + hashlib.blake2b(bytes(c for color in palette for c in color), digest_size=8).hexdigest()
+
+    def _load(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        entry = self._read(key, self._load_entry)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    @staticmethod
+    def _load_entry(f):
+        with np.load(f) as entry:
+            return entry['palette'], entry['indices'], entry['opaque']
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, atlas, palette): # Returns the quantized palette and RGBA atlas, or None.
+        for key in self._keys(atlas, palette):
+            entry = self._load(key)
+            if entry is not None:
+                colors, indices, opaque = entry
+                opaque = np.unpackbits(opaque, count=len(indices)).astype(bool)
+                rgba = np.empty((len(indices), 4), dtype=np.uint8)
+                rgba[:, :3] = colors[indices]
+                rgba[:, 3] = 255
+                rgba[~opaque] = (*palette[0], 0)
+                return [tuple(int(c) for c in color) for color in colors], rgba.reshape(-1)
+        return None
+
+    def put(self, atlas, palette, quantized_atlas, quantized_palette, palette_dependent: bool):
+        key = self._keys(atlas, palette)[1 if palette_dependent else 0]
+        indices, opaque, exact = palette_index(quantized_atlas, quantized_palette)
+        entry = (np.array(quantized_palette, dtype=np.uint8).reshape(-1, 3), indices, np.packbits(opaque))
+        self._remember(key, entry)
+        try:
+            self._write(key, lambda f: np.savez_compressed(f, palette=entry[0], indices=entry[1], opaque=entry[2])) # Index planes are mostly runs, compressed entries are a fraction of the size.
+        except OSError as e:
+            print(f"Warning: Failed to write quantization cache: {e}")
+
+quantize_cache = QuantizeCache()
+
+def sti_info(data): # Header fields needed to list and lay out an STI without decoding it, None if it isn't one.
+    if len(data) < 64 or data[:4] != b'STCI':
+        return None
+    flags = struct.unpack('<I', data[16:20])[0]
+    height, width = struct.unpack('<HH', data[20:24])
+    info = {'flags': flags, 'width': width, 'height': height, 'num_images': 1, 'frame_width': width, 'frame_height': height, 'alpha': None}
+    if (flags >> 3) & 1: # Indexed, alpha is palette[0] and the first sub header entry has the frame size.
+        num_colors = struct.unpack('<I', data[24:28])[0]
+        sub_header_start = 64 + num_colors * 3
+        info['num_images'] = struct.unpack('<H', data[28:30])[0]
+        info['alpha'] = tuple(data[64:67])
+        if info['num_images'] and len(data) >= sub_header_start + 16:
+            info['frame_height'], info['frame_width'] = struct.unpack('<HH', data[sub_header_start + 12:sub_header_start + 16])
+    return info
+
+class Frames(Sequence): # RGBA images of an STI8 as uint8 views into one contiguous atlas buffer, each one is only decoded and expanded the first time it's accessed. The number of images is fixed.
+    def __init__(self, sti, images=None):
+        sizes = [len(image) for image in images] if images is not None else [entry['width'] * entry['height'] * 4 for entry in sti.sub_header]
+        self.sti = sti
+        self.expanded = [None] * len(sizes) # Expanded images, None until first accessed.
+        self.dirty = set()
+        self.replaced = images is not None # The whole list was assigned, nothing of the compressed data is kept.
+        self._layout(sizes)
+        for index, image in enumerate(images or []):
+            self[index] = image
+
+    def _layout(self, sizes):
+        ends = np.cumsum(sizes, dtype=np.int64).tolist()
+        self.bounds = list(zip([0] + ends[:-1], ends))
+        self.atlas = np.empty(ends[-1] if ends else 0, dtype=np.uint8)
+
+    def _resize(self, index, size): # An image changed size, expanded images are copied into a new buffer and become views into it.
+        old_atlas, old_bounds = self.atlas, self.bounds
+        self._layout([size if i == index else end - start for i, (start, end) in enumerate(old_bounds)])
+        for i, (start, end) in enumerate(old_bounds):
+            if i != index and self.expanded[i] is not None:
+                new_start, new_end = self.bounds[i]
+                self.atlas[new_start:new_end] = old_atlas[start:end]
+                self.expanded[i] = self.atlas[new_start:new_end]
+
+    def __len__(self):
+        return len(self.expanded)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        if self.expanded[index] is None:
+            start, end = self.bounds[index]
+            self.expanded[index] = palette_expand(self.sti.frame_indices(index), self.sti.palette, out=self.atlas[start:end], opaque=self.sti.frame_opaque(index))
+        return self.expanded[index]
+
+    def __setitem__(self, index, image): # Writes straight into the atlas buffer.
+        if isinstance(index, slice):
+            indices, images = range(len(self))[index], list(image)
+            if len(images) != len(indices):
+                raise ValueError("The number of images of an STI can't be changed")
+            for i, image in zip(indices, images):
+                self[i] = image
+            return
+        index = range(len(self))[index]
+        data = np.frombuffer(image, dtype=np.uint8) if isinstance(image, (bytes, bytearray, memoryview)) else np.asarray(image, dtype=np.uint8).reshape(-1)
+        start, end = self.bounds[index]
+        if len(data) != end - start:
+            self._resize(index, len(data))
+            start, end = self.bounds[index]
+        self.atlas[start:end] = data
+        self.expanded[index] = self.atlas[start:end]
+        self.dirty.add(index)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def clean(self): # Dirty images were saved, drop them so they're expanded again from the new index planes.
+        for index in self.dirty:
+            self.expanded[index] = None
+        self.dirty = set()
+
+    def joined(self): # The whole atlas with every image expanded, no copies.
+        for index in range(len(self)):
+            self[index]
+        return self.atlas
 
 class STI8:
-    def __init__(self, source: str | bytes | None = None):   
+    def __init__(self, source: str | bytes | memoryview | None = None):   
         self.transparent, self.high, self.indexed, self.zlib, self.etrle = False, False, True, False, True
         self.size_uncompressed = self.num_pixels = self.size_compressed = 0
         self.height = 480
@@ -15,14 +158,19 @@ class STI8:
         self.bit_depth = self.r_depth = self.g_depth = self.b_depth = 8
         self.num_images = 10
         self.palette = ((0,0,0)) * self.num_colors
-        self.sub_header = self.images = []
+        self.sub_header = []
+        self._indices = [] # One uint8 palette index plane per image, transparent pixels are index 0. None until decoded.
+        self._opaque = [] # Opacity mask of every index plane, a literal index 0 pixel is opaque. None until decoded.
+        self._images = []
+        self._compressed = bytes()
+        self._sequential = False # Set when the sub header offsets turned out to be unusable.
         self.atlas = bytes()
         self.modified = False
         self.index = 0 # Only used in __str__.
 
         if source is not None:
             header_size = 64
-            data = source if isinstance(source, bytes) else open(source, 'rb').read()
+            data = source if isinstance(source, (bytes, memoryview)) else open(source, 'rb').read()
             if data[:4] != b'STCI':
                 raise ValueError("Invalid STI file header")
             flags = struct.unpack('<I', data[16:20])[0]
@@ -49,45 +197,104 @@ class STI8:
                     w = struct.unpack('<H', data[offset+14:offset+16])[0]
                     h = struct.unpack('<H', data[offset+12:offset+14])[0]
                     self.sub_header.append({'offset': image_start, 'size': size, 'x': x, 'y': y, 'height': h, 'width': w})
-                self.atlas = etrle_decompress(self.atlas,self.palette,self.sub_header)
-                self._split_atlas()
+                self._compressed = self.atlas
+                self.atlas = bytes()
+                self._indices = [None] * self.num_images
+                self._opaque = [None] * self.num_images
+                self._sequential = not self._offsets_line_up()
+                self._images = Frames(self) # Nothing is decoded until an image is actually asked for.
                 self.size_uncompressed = sum(self.sub_header[i]['width'] * self.sub_header[i]['height'] * 3 for i in range(self.num_images))
             except Exception as e:
                 raise ValueError("Broken or unsupported file")
                 
-    def _split_atlas(self):
-        self.images = []
-        offset = 0
+    def _offsets_line_up(self): # Single images can only be cut out of the compressed data if the sub header offsets and sizes cover it exactly, in order.
+        end = 0
         for entry in self.sub_header:
-            width = entry['width']
-            height = entry['height']
-            size = width * height * 4
-            self.images.append(self.atlas[offset:offset + size])
-            offset += size   
-        
-    def _join_atlas(self):
-        realsize = self.sub_header[0]['width'] * self.sub_header[0]['height'] * 4
-        new_atlas = bytearray()
-        for image in self.images:
-            new_atlas.extend(image)
-        self.atlas = new_atlas  
-             
-        
-    def _update_subheader(self, compressed_data): # Because raw image bytes contain no information about dimensions, any updates to the resolution and offset must be done in the code that changes the image, it cannot be handled here.
+            if entry['offset'] != end:
+                return False
+            end += entry['size']
+        return end == len(self._compressed)
+
+    def frame_indices(self, index): # Decodes a single image straight from its compressed slice using the sub header offset and size.
+        if self._indices[index] is None and not self._sequential:
+            entry = self.sub_header[index]
+            try:
+                self._indices[index], self._opaque[index] = etrle_decompress_frame(self._compressed[entry['offset']:entry['offset'] + entry['size']], entry)
+            except ValueError:
+                self._sequential = True
+        if self._indices[index] is None: # Sub header doesn't line up with the data, decode everything in sequence instead.
+            self._indices, self._opaque = etrle_decompress_indexed(self._compressed, self.sub_header)
+        return self._indices[index]
+
+    def frame_opaque(self, index):
+        self.frame_indices(index)
+        return self._opaque[index]
+
+    @property
+    def indices(self):
+        return [self.frame_indices(i) for i in range(len(self._indices))]
+
+    @property
+    def images(self):
+        return self._images
+
+    @images.setter
+    def images(self, images):
+        self._images = images if isinstance(images, Frames) else Frames(self, images)
+
+    def _reusable_frames(self): # Untouched images can keep their compressed bytes if the sub header describes the data exactly.
+        if not self._offsets_line_up():
+            return False
+        for index in self._images.dirty: # Decoding a replaced image checks that its slice really is that image.
+            self.frame_indices(index)
+        return not self._sequential
+
+    def _encode_dirty_frame(self, index): # Re-encodes a single replaced image against the current palette, None if the palette can't represent it.
+        entry = self.sub_header[index]
+        pixels = self._images[index]
+        if len(pixels) != entry['width'] * entry['height'] * 4:
+            return None
+        pixels = pixels.reshape(-1, 4).copy()
+        opaque = pixels[:, 3] != 0
+        portrait = len(self.sub_header) == 10 and all((e['width'], e['height']) == (90, 72) for e in self.sub_header)
+        if index == 0 and portrait and not opaque.all(): # Base portrait transparency is handled by _fix_alpha and quantization.
+            return None
+        pixels[opaque & np.all(pixels[:, :3] == 0, axis=1), :3] = 1 # Same black fix as _fix_alpha.
+        indices, opaque, exact = palette_index(pixels.tobytes(), self.palette)
+        if not exact or not np.all(indices[opaque] != 0):
+            return None
+        indices[~opaque] = 0
+        plane = indices.reshape(entry['height'], entry['width'])
+        mask = opaque.reshape(entry['height'], entry['width'])
+        return plane, mask, etrle_compress_indexed([plane], [entry], [mask])[0]
+
+    def _encode_frames(self): # Compressed bytes of every image when only replaced images need encoding, None if the whole atlas has to be requantized.
+        if not isinstance(self._images, Frames) or self._images.replaced:
+            return None
+        reusable = self._reusable_frames()
+        planes = {}
+        masks = {}
+        frames = []
+        for index, entry in enumerate(self.sub_header):
+            if index in self._images.dirty:
+                encoded = self._encode_dirty_frame(index)
+                if encoded is None:
+                    return None
+                planes[index], masks[index], data = encoded
+            elif reusable:
+                data = self._compressed[entry['offset']:entry['offset'] + entry['size']]
+            else:
+                data = etrle_compress_indexed([self.frame_indices(index)], [entry], [self.frame_opaque(index)])[0]
+            frames.append(data)
+        for index, plane in planes.items():
+            self._indices[index] = plane
+            self._opaque[index] = masks[index]
+        return frames
+
+    def _update_subheader(self, frames): # Because raw image bytes contain no information about dimensions, any updates to the resolution must be done in the code that changes the image. Offsets and sizes come straight from the encoder.
         if self.etrle and self.indexed:
-            current_pos = 0
-            for i in range(self.num_images):
-                self.sub_header[i]['offset'] = sum(self.sub_header[j]['size'] for j in range(i))
-                pos = compressed_data.find(b'\xda\x00', current_pos)
-                while pos + 4 <= len(compressed_data) and compressed_data[pos + 2:pos + 4] == b'\xda\x00':
-                    pos += 2
-                next_start = pos + 2
-                lastsize = self.sub_header[i]['size']
-                if i != 0: 
-                    self.sub_header[i]['size'] = next_start - current_pos
-                if i == 5: self.sub_header[i]['size'] = self.sub_header[i-1]['size'] # Ugly fix
-                if i == 9: self.sub_header[i]['size'] = self.sub_header[i-1]['size'] # This is what regret looks like
-                current_pos = next_start
+            for entry, (offset, size) in zip(self.sub_header, frames):
+                entry['offset'], entry['size'] = offset, size
             self.size_uncompressed = sum(self.sub_header[i]['width'] * self.sub_header[i]['height'] * 3 for i in range(self.num_images))
         else:
             raise ValueError("Invalid File")
@@ -106,9 +313,17 @@ class STI8:
         buffer[black_mask, :3] = [1, 1, 1]
         if width == 90 and height == 720: # Dogshit way to check if we're working with a portrait.
             buffer[:72, :, :3][alpha_mask[:72, :]] = [1, 1, 1] # Convert transparent pixels to black pixels for the base portrait to prevent issues.
-        self.atlas = buffer.tobytes()
 
-    def _quantize_atlas(self):
+    def _quantize_atlas(self): # Identical atlases quantize identically, so the result is looked up before running the quantizer.
+        cached = quantize_cache.get(self.atlas, self.palette)
+        if cached is not None:
+            self.palette, self.atlas = cached
+            return
+        atlas, palette = self.atlas, self.palette
+        palette_dependent = self._requantize_atlas()
+        quantize_cache.put(atlas, palette, self.atlas, self.palette, palette_dependent)
+
+    def _requantize_atlas(self): # Returns True if the result depends on the old palette, not just its alpha and end colors.
         alpha = self.palette[0]
         end = self.palette[255]
         palette = [alpha]
@@ -133,43 +348,34 @@ class STI8:
             try: # To use libimagequant for quantization
                 import imagequant
                 output_indices, output_palette = imagequant.quantize_raw_rgba_bytes(
-                    self.atlas, 
+                    bytes(self.atlas), # Only takes bytes.
                     width, height, 
                     dithering_level=0.0, 
                     max_colors=254, 
                     min_quality=0,   
                     max_quality=100 
                 )
-                palette = []
-                for i in range(0, 1016, 4):
-                    r = output_palette[i]
-                    g = output_palette[i+1]
-                    b = output_palette[i+2]
-                    if r == 0 and g == 0 and b == 0: r = g = b = 1 # Prevent 100% black, because it's transparent.
-                    palette.append((r, g, b))         
-
-                rgba_bytes = bytearray(width * height * 4)
-                for i, idx in enumerate(output_indices):
-                    if idx < len(palette):
-                        r, g, b = palette[idx]
-                        rgba_bytes[i*4]     = r
-                        rgba_bytes[i*4+1]   = g
-                        rgba_bytes[i*4+2]   = b
-                        rgba_bytes[i*4+3]   = 255  # Opaque by default
-                    else:
-                        rgba_bytes[i*4:i*4+4] = [0, 0, 0, 0]  # Fallback
-                
+                quant_palette = np.ones((254, 3), dtype=np.uint8) # Padded with 1,1,1 in case fewer colors come back.
+                returned = np.frombuffer(bytes(output_palette), dtype=np.uint8)[:1016].reshape(-1, 4)[:, :3]
+                quant_palette[:len(returned)] = returned
+                quant_palette[np.all(quant_palette == 0, axis=1)] = 1 # Prevent 100% black, because it's transparent.
+                palette = [tuple(int(c) for c in color) for color in quant_palette]
+
+                indices = np.frombuffer(bytes(output_indices), dtype=np.uint8)
+                rgba = np.zeros((len(indices), 4), dtype=np.uint8)
+                valid = indices < len(quant_palette)
+                rgba[valid, :3] = quant_palette[indices[valid]]
+                rgba[valid, 3] = 255 # Opaque by default
+
                 # Fix alpha
-                for i in range(0, len(self.atlas), 4):
-                    r, g, b, a = self.atlas[i], self.atlas[i+1], self.atlas[i+2], self.atlas[i+3]
-                    if r == alpha[0] and g == alpha[1] and b == alpha[2] and a == 0:
-                        rgba_bytes[i:i+4] = [alpha[0], alpha[1], alpha[2], 0]
-            
-                self.atlas = bytes(rgba_bytes)
+                source = np.frombuffer(self.atlas, dtype=np.uint8).reshape(-1, 4)
+                rgba[np.all(source[:, :3] == alpha, axis=1) & (source[:, 3] == 0)] = (*alpha, 0)
+
+                self.atlas = rgba.reshape(-1)
                 palette.insert(0, alpha)
                 palette.append(end)
                 self.palette = palette
-                return
+                return False
             except: # Fallback to pillow for quantization, not only is the quantization method worse, the code is also worse. Works tho, just generates suboptimal palettes.
                 print("Warning: Quantizing with libimagequant failed, falling back to pillow...")
                 palette_img = rgb_atlas.quantize(colors=254, method=1)
@@ -177,17 +383,13 @@ class STI8:
                 palette = [tuple(palette[i:i+3]) for i in range(0, len(palette), 3)]
                 palette.insert(0, alpha)
                 palette.append(end)
-                self.atlas = palette_img.convert('RGBA').tobytes()
+                rgba = np.array(palette_img.convert('RGBA'), dtype=np.uint8).reshape(-1, 4)
                 
                 # Fix alpha
-                atlas_list = list(self.atlas)
-                for i in range(0, len(atlas_list), 4):
-                    if (atlas_list[i], atlas_list[i+1], atlas_list[i+2]) == alpha:
-                        atlas_list[i+3] = 0 
-                        
-                self.atlas = bytes(atlas_list)
+                rgba[np.all(rgba[:, :3] == alpha, axis=1), 3] = 0
+                self.atlas = rgba.reshape(-1)
                 self.palette = palette
-                return
+                return False
         else:
             # Add padding if needed to make it 254 colors before adding alpha and end
             padding_needed = 254 - color_count
@@ -200,17 +402,32 @@ class STI8:
         total_matches = sum((Counter(palette) & Counter(self.palette)).values())
         if total_matches < 254: # Use original palette if there were minimal changes. This allows the extract function in the GUI to extract the vanilla STI files unaltered.
             self.palette = palette 
+        return True
                      
     def _update(self):
-        self._join_atlas()
+        self.atlas = self._images.joined() # Fixed in place, the images are views into it.
         self._fix_alpha()
         self._quantize_atlas()
-        self._split_atlas()    
         
     def save(self, filename: str = None):
-        self._update()
-        img_data = etrle_compress(self.atlas, self.palette, self.sub_header)
-        self._update_subheader(img_data)
+        encoded = self._encode_frames()
+        if encoded is not None: # Only replaced images were encoded, the rest kept their compressed bytes.
+            frames = []
+            offset = 0
+            for data in encoded:
+                frames.append((offset, len(data)))
+                offset += len(data)
+            img_data = b''.join(encoded)
+            self._images.clean()
+        else:
+            self._update()
+            img_data, frames = etrle_compress(self.atlas, self.palette, self.sub_header)
+            self._indices = [None] * len(self.sub_header)
+            self._opaque = [None] * len(self.sub_header)
+            self._images = Frames(self)
+        self._compressed = bytes(img_data)
+        self._sequential = False
+        self._update_subheader(frames)
         self.num_pixels = self.width * self.height
         self.size_compressed = len(img_data)
         flags = (self.transparent | (self.high << 2) | (self.indexed << 3) | (self.zlib << 4) | (self.etrle << 5))
@@ -264,7 +481,7 @@ class STI8:
             image_size_str = f"Sizes:\n  Compressed:        {self.size_compressed}\n  Uncompressed:  {self.size_uncompressed}\n  Atlas Size:              {self.num_pixels * 3}"  
         return (
             f"STI8 Info\n"
-            f"Images: {len(self.images)}\n"
+            f"Images: {len(self.sub_header)}\n"
             f"Atlas Resolution: {self.width}x{self.height}\n"
             f"Atlas Pixels: {self.num_pixels}\n"
             f"Image Resolution: {self.sub_header[self.index]['width']}x{self.sub_header[self.index]['height']}\n"
@@ -276,8 +493,21 @@ class STI8:
         )
 
 
+def rgb565_to_rgb888(source): # Plain bit shifts, the low bits are left at 0 so it round trips exactly with rgb888_to_rgb565.
+    rgb565 = np.frombuffer(source, dtype='<u2')
+    rgb888 = np.empty((len(rgb565), 3), dtype=np.uint8)
+    rgb888[:, 0] = ((rgb565 >> 11) & 0x1F) << 3
+    rgb888[:, 1] = ((rgb565 >> 5) & 0x3F) << 2
+    rgb888[:, 2] = (rgb565 & 0x1F) << 3
+    return rgb888.tobytes()
+
+def rgb888_to_rgb565(image):
+    rgb888 = np.frombuffer(image, dtype=np.uint8).reshape(-1, 3).astype('<u2')
+    rgb565 = ((rgb888[:, 0] >> 3) << 11) | ((rgb888[:, 1] >> 2) << 5) | (rgb888[:, 2] >> 3)
+    return rgb565.astype('<u2').tobytes()
+
 class STI16:
-    def __init__(self, source: str | bytes | None = None):   
+    def __init__(self, source: str | bytes | memoryview | None = None):   
         self.transparent, self.high, self.indexed, self.zlib, self.etrle = False, True, False, False, False
         self.size_uncompressed = self.size_compressed = self.height = self.width = 0
         self.num_colors, self.bit_depth = 63488, 16
@@ -287,7 +517,7 @@ class STI16:
         self.modified = False
 
         if source is not None:
-            data = source if isinstance(source, bytes) else open(source, 'rb').read()
+            data = source if isinstance(source, (bytes, memoryview)) else open(source, 'rb').read()
             if data[:4] != b'STCI':
                 raise ValueError("Invalid STI file header")
 
@@ -300,17 +530,10 @@ class STI16:
             self.r_mask, self.g_mask, self.b_mask = struct.unpack('<III', data[24:36])
             self.r_depth, self.g_depth, self.b_depth = data[40], data[41], data[42]
             self.bit_depth = data[44]
-            # RGB 565 to RGB 888
-            source = data[64:]
-            rgb888 = bytearray(len(source) * 3 // 2)
-            for i in range(0, len(source), 2):
-                rgb565 = source[i] | (source[i+1] << 8)
-                r, g, b = (rgb565 >> 11) & 0x1F, (rgb565 >> 5) & 0x3F, rgb565 & 0x1F
-                rgb888[i*3//2:i*3//2+3] = (r << 3, g << 2, b << 3)
-            self.image = bytes(rgb888)
+            self.image = rgb565_to_rgb888(data[64:])
 
     def save(self, filename: str = None):
-        img_data = bytearray().join(struct.pack('<H', ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)) for i in range(0, len(self.image), 3) for r, g, b in [self.image[i:i+3]])
+        img_data = rgb888_to_rgb565(self.image)
         self.size_uncompressed = self.size_compressed = len(img_data)
         flags = (self.transparent | (self.high << 2) | (self.indexed << 3) | (self.zlib << 4) | (self.etrle << 5))
         header = (
@@ -353,3 +576,23 @@ class STI16:
             f"{image_size_str}\n"
             f"Color Information:\n    Colors: {self.num_colors}\n        Bit Depth: {self.bit_depth} (Mask)\n\t      R: {self.r_depth}  ({self.r_mask:04X})\n\t      G: {self.g_depth}  ({self.g_mask:04X})\n\t      B: {self.b_depth}  ({self.b_mask:04X})\n"
         )
+
+def encode_sti(data, images, sizes=None): # Saves an STI with some of its images replaced, images maps image index to RGBA bytes (RGB at index 0 for STI16) and sizes to a new (width, height). Plain bytes in and out so it can run in a worker process.
+    info = sti_info(data)
+    if info is None:
+        raise ValueError("Invalid STI file header")
+    sizes = sizes or {}
+    if (info['flags'] >> 2) & 1:
+        sti = STI16(data)
+        sti.image = images[0]
+        sti.width, sti.height = sizes.get(0, (sti.width, sti.height))
+    else:
+        sti = STI8(data)
+        for index, image in images.items():
+            sti.images[index] = image
+        for index, (width, height) in sizes.items():
+            sti.sub_header[index].update({'x': 0, 'y': 0, 'width': width, 'height': height})
+    return sti.save()
+
+def set_quantize_cache_directory(directory): # Worker process initializer, spawned workers don't inherit what main set.
+    quantize_cache.directory = directory
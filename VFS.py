@@ -0,0 +1,89 @@
+import os
+import re
+from collections.abc import Mapping
+from PATCH import PATCH
+from SLF import PathIndex
+
+class VFS(Mapping): # Stacks DATA.SLF and the patch files the way the game does, every path resolves to the topmost layer that has it.
+    def __init__(self):
+        self.layers = [] # (name, files) from the bottom up, files is any path -> data mapping, e.g. an SLF or PATCH.content.
+        self.index = {}  # path -> layer number of the topmost static layer providing it.
+        self.live = []   # Layers that change while mounted, like the patch being edited. Checked on lookup instead of indexed, topmost first.
+
+    def mount(self, name, files, live=False): # Mounts on top of everything mounted so far.
+        layer = len(self.layers)
+        self.layers.append((name, files))
+        if live:
+            self.live.insert(0, layer)
+        else:
+            self.index.update(dict.fromkeys(files.keys(), layer))
+        return layer
+
+    def mount_patches(self, directory, live=None): # Every PATCH.### in the directory in ascending order, higher numbers override lower ones. live maps file names to already opened PATCH objects that are being edited, they're mounted even if not on disk yet.
+        live = {name.upper(): patch for name, patch in (live or {}).items()}
+        names = {name.upper(): name for name in (os.listdir(directory) if os.path.isdir(directory) else []) if re.fullmatch(r'PATCH\.\d+', name, re.IGNORECASE)}
+        names.update((name, name) for name in live)
+        for key in sorted(names, key=lambda name: int(name.split('.')[1])):
+            if key in live:
+                self.mount(key, live[key].content, live=True)
+            else:
+                try:
+                    self.mount(key, PATCH(os.path.join(directory, names[key]), lazy=True).content)
+                except Exception as e:
+                    print(f"Warning: Skipping unreadable patch {names[key]}: {e}")
+
+    def _locate(self, path):
+        layer = self.index.get(path, -1)
+        for live in self.live:
+            if live < layer:
+                break
+            if path in self.layers[live][1]:
+                return live
+        if layer < 0:
+            raise KeyError(path)
+        return layer
+
+    def below(self, name): # The stack under the named layer, what its paths fall back to without it.
+        vfs = VFS()
+        for layer, (layer_name, files) in enumerate(self.layers):
+            if layer_name == name:
+                break
+            vfs.mount(layer_name, files, live=layer in self.live)
+        return vfs
+
+    def layer(self, path): # Name of the layer the path is read from.
+        return self.layers[self._locate(path)][0]
+
+    def files_from(self, name): # Paths whose effective version comes from the named layer.
+        return [path for path in self if self.layer(path) == name]
+
+    def _query(self, method, pattern): # Uses each layer's own path index where it has one.
+        found = set()
+        for name, files in self.layers:
+            index = getattr(files, 'path_index', None)
+            found.update(getattr(index if isinstance(index, PathIndex) else PathIndex(files), method)(pattern))
+        return sorted(found)
+
+    def prefix(self, prefix): # Case and separator insensitive, see PathIndex.
+        return self._query('prefix', prefix)
+
+    def glob(self, pattern):
+        return self._query('glob', pattern)
+
+    def __getitem__(self, path): # Data is read lazily by the providing layer.
+        return self.layers[self._locate(path)][1][path]
+
+    def __contains__(self, path):
+        try:
+            self._locate(path)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        yield from self.index
+        for live in self.live:
+            yield from (path for path in self.layers[live][1] if path not in self.index and not any(path in self.layers[other][1] for other in self.live if other > live))
+
+    def __len__(self):
+        return sum(1 for path in self)
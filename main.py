@@ -2,30 +2,48 @@ import tkinter as tk
 from tkinter import filedialog
 import os
 import sys
-from STI import STI8, STI16
+import multiprocessing
+from STI import STI8, STI16, quantize_cache
 from PATCH import PATCH
-from SLF import SLF
+from SLF import SLF, index_cache
+from VFS import VFS
 from GUI import GUI
 
 
 def main():
     gamedir = find_wiz8_dir()
+    quantize_cache.directory = os.path.join(user_cache_dir(), "quantize")
+    index_cache.directory = os.path.join(user_cache_dir(), "index")
     
     data_slf_path = os.path.join(gamedir, "Data", "DATA.SLF")
-    slf = SLF(data_slf_path)
+    slf = SLF(data_slf_path, use_mmap=True)
     
     patch_path = os.path.join(gamedir, "Patches", "PATCH.010")
     if os.path.exists(patch_path):
-        patch_file = PATCH(patch_path)
+        patch_file = PATCH(patch_path, lazy=True)
     else:
         patch_file = PATCH()
     patch_file.path = patch_path
             
     
-    gui = GUI(fetch_portraits(slf), patch_file.content)
+    default_portraits = fetch_portraits(slf)
+    portrait_flags = index_cache.get(data_slf_path, "portrait flags")
+    if portrait_flags is None:
+        portrait_flags = fetch_portrait_flags(default_portraits)
+        index_cache.put(data_slf_path, portrait_flags, "portrait flags")
+    vfs = VFS()
+    vfs.mount("DATA.SLF", slf)
+    vfs.mount_patches(os.path.dirname(patch_path), {os.path.basename(patch_path): patch_file})
+    patch_file.defaults = vfs.below(os.path.basename(patch_path).upper()) # DATA.SLF and any lower patches, entries matching what's under PATCH.010 anyway are left out.
+    gui = GUI(default_portraits, patch_file.content, vfs, portrait_flags)
     gui.patch_file = patch_file
     slf = patch_file = None # Clear up some memory, think of the poor.
     gui.root.mainloop()
+    gui.prefetcher.shutdown(wait=False, cancel_futures=True)
+    gui.decoder.shutdown(wait=False, cancel_futures=True)
+    if gui.encoder is not None:
+        gui.encoder.shutdown(wait=False, cancel_futures=True)
+    gui.saver.shutdown(wait=True) # Let a save that's still writing finish.
 
 def find_wiz8_dir():
     possible_dirs = [
@@ -50,14 +68,21 @@ def find_wiz8_dir():
     directory = tk.filedialog.askdirectory(title="Select Wizardry 8 Directory")
     return directory
 
-def fetch_portraits(slf):
-    return {
-        filename: slf.data[addr:addr+size]
-        for filename, (addr, size) in slf.files.items()
-        if filename.startswith("PORTRAITS")
-    }
+def user_cache_dir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "Wiz8PortraitSwapper")
+
+def fetch_portraits(slf): # Zero-copy memoryview slices when the SLF is memory-mapped.
+    return {filename: slf[filename] for filename in slf.path_index.prefix("PORTRAITS\\")}
+
+def fetch_portrait_flags(portraits): # STI flags of every portrait, only reads the first bytes of each entry.
+    return {key: int.from_bytes(data[16:20], 'little') for key, data in portraits.items() if key.upper().endswith('.STI') and data[:4] == b'STCI'}
 
     
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # The import workers are started from the frozen executable too.
     main()
 
@@ -0,0 +1,31 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Extras'))
+from STI import rgb565_to_rgb888, rgb888_to_rgb565
+from BENCH import rgb565_to_rgb888_py, rgb888_to_rgb565_py
+
+'''
+STI16 RGB565 codec against the old per-pixel loops, run with: python tests/test_rgb565.py
+'''
+
+class TestRGB565(unittest.TestCase):
+    def test_round_trip(self): # Every RGB565 value survives decoding and encoding again.
+        every_color = np.arange(65536, dtype='<u2').tobytes()
+        self.assertEqual(rgb888_to_rgb565(rgb565_to_rgb888(every_color)), every_color)
+
+    def test_decode_matches_reference(self):
+        every_color = np.arange(65536, dtype='<u2').tobytes()
+        self.assertEqual(rgb565_to_rgb888(every_color), rgb565_to_rgb888_py(every_color))
+
+    def test_encode_matches_reference(self):
+        rgb = np.random.default_rng(0).integers(0, 256, 160 * 120 * 3, dtype=np.uint8).tobytes()
+        self.assertEqual(rgb888_to_rgb565(rgb), rgb888_to_rgb565_py(rgb))
+        every_byte = np.arange(256, dtype=np.uint8).repeat(3).tobytes()
+        self.assertEqual(rgb888_to_rgb565(every_byte), rgb888_to_rgb565_py(every_byte))
+
+if __name__ == "__main__":
+    unittest.main()